@@ -0,0 +1,632 @@
+"""
+Fused map algebra.  Raster expressions such as "(b4 - b3) / (b4 + b3)" are
+parsed once into a short program of in-place NumPy ufunc calls over a small
+set of registers.  Registers are reused as soon as their value is consumed
+and are preallocated once per tile shape, so evaluating a tile allocates no
+full-size intermediates.  Expressions are evaluated tile by tile over named
+rasters aligned with RasterStack.
+"""
+
+import ast
+
+import numpy as np
+
+from spatial_tools.raster import envelope, stack, writer
+
+
+class ExpressionError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+
+_COMPARE_OPS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+_BOOL_OPS = {
+    ast.And: np.logical_and,
+    ast.Or: np.logical_or,
+}
+
+# Functions producing truth values, which are evaluated in the input types
+_LOGICAL_FUNCS = frozenset(list(_COMPARE_OPS.values()) +
+    list(_BOOL_OPS.values()) + [np.logical_not])
+
+_FUNCTIONS = {
+    'abs': np.absolute,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'floor': np.floor,
+    'ceil': np.ceil,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+    'clip': np.clip,
+}
+
+
+def _where(cond, a, b, out=None, scratch=None):
+    """
+    In-place equivalent of numpy.where.  out may alias cond or b, but not a.
+    """
+    np.not_equal(cond, 0, out=scratch)
+    if out is not b:
+        np.copyto(out, b, casting='unsafe')
+    np.copyto(out, a, where=scratch, casting='unsafe')
+    return out
+
+
+def _make_reclass(table, default):
+    """
+    Return a function applying a lookup table.  table is either a dict of
+    exact {value: new_value} pairs or a sequence of (low, high, new_value)
+    tuples matching low <= value < high.  Unmatched cells get default.
+    """
+    if isinstance(table, dict):
+        keys = np.array(sorted(table), dtype=np.float64)
+        values = np.array([table[k] for k in sorted(table)],
+            dtype=np.float64)
+
+        def reclass(x, out=None, scratch=None):
+            index = np.searchsorted(keys, x)
+            np.clip(index, 0, len(keys) - 1, out=index)
+            np.equal(keys[index], x, out=scratch)
+            np.copyto(out, default, casting='unsafe')
+            np.copyto(out, values[index], where=scratch, casting='unsafe')
+            return out
+        return reclass
+
+    ranges = sorted(table)
+    for (i, (low, high, _)) in enumerate(ranges):
+        if low >= high or (i and low < ranges[i - 1][1]):
+            err_str = 'Reclass ranges must be increasing and disjoint'
+            raise ExpressionError(err_str)
+
+    def reclass_ranges(x, out=None, scratch=None):
+        # Write into a copy of x's value only after all tests are done, as
+        # out may alias x
+        result = np.full(x.shape, default, dtype=out.dtype)
+        for (low, high, value) in ranges:
+            np.greater_equal(x, low, out=scratch)
+            scratch &= x < high
+            result[scratch] = value
+        np.copyto(out, result)
+        return out
+    return reclass_ranges
+
+
+class Expression(object):
+    """
+    An Expression compiles a raster expression into a fused program.  Names
+    in the expression refer to input arrays.  Supported syntax:
+
+    * arithmetic: + - * / // % ** and unary minus
+    * comparisons: < <= > >= == != (true is 1, false is 0)
+    * logic: and, or, not
+    * conditionals: "a if cond else b" or where(cond, a, b)
+    * functions: abs, sqrt, exp, log, log10, floor, ceil, minimum, maximum,
+      clip(x, low, high)
+    * reclassification: reclass(x, {1: 10, 2: 20}, default) or
+      reclass(x, [(low, high, value), ...], default)
+
+    Instances keep per-shape buffers and are not thread-safe; use one
+    instance per thread.
+    """
+
+    def __init__(self, expression, dtype=np.float32, nodata=None):
+        """
+        Parse and compile an expression
+
+        Parameters
+        ----------
+        expression : str
+            The expression to compile
+
+        dtype : numpy.dtype
+            Data type of the registers and the result.  For floating-point
+            types, all arithmetic is computed in this type so that integer
+            inputs cannot overflow or wrap.  For integer types, NumPy's
+            type promotion applies
+
+        nodata : number
+            Output value for cells where any input is nodata or the result
+            is not finite.  If None, no masking is done
+        """
+        self._expression = expression
+        self._dtype = np.dtype(dtype)
+        self._nodata = nodata
+        if np.issubdtype(self._dtype, np.inexact):
+            self._arith_kwargs = {'dtype': self._dtype, 'casting': 'unsafe'}
+        else:
+            self._arith_kwargs = {'casting': 'unsafe'}
+        self._names = set()
+        self._program = []
+        self._n_regs = 0
+        self._free = []
+        self._buffers = {}
+
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError as e:
+            err_str = 'Invalid expression: %s' % e
+            raise ExpressionError(err_str)
+        self._result = self._compile(tree.body)
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def expression(self):
+        return self._expression
+
+    @property
+    def names(self):
+        return sorted(self._names)
+
+    @property
+    def n_registers(self):
+        return self._n_regs
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def nodata(self):
+        return self._nodata
+    # pylint: enable=missing-docstring
+
+    def _alloc(self):
+        """
+        Return a free register, creating one if none are free
+        """
+        if self._free:
+            return self._free.pop()
+        self._n_regs += 1
+        return self._n_regs - 1
+
+    def _emit(self, func, args, out=None, scratch=False):
+        """
+        Append an instruction.  The output register reuses the first
+        register argument (or out if given) and other register arguments
+        are freed.  If scratch is True, func is passed the boolean scratch
+        buffer instead of a casting rule.
+        """
+        regs = [a[1] for a in args if a[0] == 'reg']
+        if out is None:
+            out = regs[0] if regs else self._alloc()
+        for reg in regs:
+            if reg != out:
+                self._free.append(reg)
+        self._program.append((func, out, args, scratch))
+        return ('reg', out)
+
+    def _compile(self, node):
+        """
+        Compile an AST node into instructions, returning its operand:
+        ('const', value), ('input', name) or ('reg', index)
+        """
+        if isinstance(node, ast.Constant) and \
+                isinstance(node.value, (int, float, bool)):
+            return ('const', float(node.value))
+
+        if isinstance(node, ast.Name):
+            self._names.add(node.id)
+            return ('input', node.id)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            return self._compile_ufunc(_BINARY_OPS[type(node.op)],
+                [node.left, node.right])
+
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.USub):
+                return self._compile_ufunc(np.negative, [node.operand])
+            if isinstance(node.op, ast.UAdd):
+                return self._compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return self._compile_ufunc(np.logical_not, [node.operand])
+
+        if isinstance(node, ast.Compare):
+            # Chained comparisons (a < b < c) become (a < b) and (b < c)
+            operands = [node.left] + list(node.comparators)
+            parts = []
+            for (op, left, right) in zip(node.ops, operands[:-1],
+                    operands[1:]):
+                if type(op) not in _COMPARE_OPS:
+                    break
+                parts.append(ast.Compare(left=left, ops=[op],
+                    comparators=[right]))
+            else:
+                if len(parts) == 1:
+                    return self._compile_ufunc(
+                        _COMPARE_OPS[type(node.ops[0])],
+                        [node.left, node.comparators[0]])
+                return self._compile(ast.BoolOp(op=ast.And(), values=parts))
+
+        if isinstance(node, ast.BoolOp):
+            func = _BOOL_OPS[type(node.op)]
+            result = self._compile(node.values[0])
+            for value in node.values[1:]:
+                result = self._apply(func, [result, self._compile(value)])
+            return result
+
+        if isinstance(node, ast.IfExp):
+            return self._compile_where(node.test, node.body, node.orelse)
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and not node.keywords:
+            name = node.func.id
+            if name == 'where' and len(node.args) == 3:
+                return self._compile_where(*node.args)
+            if name == 'reclass' and len(node.args) in (2, 3):
+                return self._compile_reclass(*node.args)
+            if name in _FUNCTIONS:
+                return self._compile_ufunc(_FUNCTIONS[name], node.args)
+
+        err_str = 'Unsupported expression element: %s' % ast.dump(node)
+        raise ExpressionError(err_str)
+
+    def _apply(self, func, operands):
+        """
+        Emit func over compiled operands, folding constants
+        """
+        if all(o[0] == 'const' for o in operands):
+            with np.errstate(all='ignore'):
+                value = func(*[o[1] for o in operands])
+            return ('const', float(value))
+        return self._emit(func, operands)
+
+    def _compile_ufunc(self, func, nodes):
+        """
+        Compile the arguments of an element-wise function and apply it
+        """
+        return self._apply(func, [self._compile(n) for n in nodes])
+
+    def _compile_where(self, test, body, orelse):
+        """
+        Compile a conditional.  The output register may alias the condition
+        or the false branch but never the true branch.
+        """
+        cond = self._compile(test)
+        a = self._compile(body)
+        b = self._compile(orelse)
+        if cond[0] == 'const':
+            return a if cond[1] else b
+        if b[0] == 'reg':
+            out = b[1]
+        elif cond[0] == 'reg':
+            out = cond[1]
+        else:
+            out = self._alloc()
+        return self._emit(_where, [cond, a, b], out=out, scratch=True)
+
+    def _compile_reclass(self, value, table, default=None):
+        """
+        Compile a lookup-table reclassification
+        """
+        try:
+            table = ast.literal_eval(table)
+            default = np.nan if default is None else \
+                float(ast.literal_eval(default))
+        except ValueError:
+            err_str = 'Reclass table and default must be literals'
+            raise ExpressionError(err_str)
+        if not isinstance(table, (dict, list, tuple)) or not table:
+            err_str = 'Reclass table must be a non-empty dict or list'
+            raise ExpressionError(err_str)
+        operand = self._compile(value)
+        out = operand[1] if operand[0] == 'reg' else self._alloc()
+        return self._emit(_make_reclass(table, default), [operand], out=out,
+            scratch=True)
+
+    def _get_buffers(self, shape):
+        """
+        Return the registers and boolean scratch arrays for a tile shape
+        """
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            regs = [np.empty(shape, dtype=self._dtype)
+                for _ in range(self._n_regs)]
+            scratch = np.empty(shape, dtype=bool)
+            mask = np.empty(shape, dtype=bool)
+            buffers = (regs, scratch, mask)
+            self._buffers[shape] = buffers
+        return buffers
+
+    def evaluate(self, inputs, out=None, input_nodata=None, mask=None):
+        """
+        Evaluate the expression over a tile
+
+        Parameters
+        ----------
+        inputs : dict
+            Arrays of the same shape keyed by name
+
+        out : numpy.ndarray
+            Optional array to write the result to.  If not given, the
+            result is returned in an internal buffer that is overwritten by
+            the next call with the same shape
+
+        input_nodata : dict
+            Nodata value of each input, keyed by name.  Only used if the
+            expression has an output nodata value
+
+        mask : numpy.ndarray
+            Optional boolean array of additional cells to set to nodata,
+            e.g. cells outside an input's footprint.  Only used if the
+            expression has an output nodata value
+
+        Returns
+        -------
+        result : numpy.ndarray
+            The evaluated tile
+        """
+        missing = self._names.difference(inputs)
+        if missing:
+            err_str = 'Missing inputs: %s' % ', '.join(sorted(missing))
+            raise ExpressionError(err_str)
+        shape = np.shape(inputs[self.names[0]]) if self._names else \
+            np.shape(out)
+        (regs, scratch, nodata_mask) = self._get_buffers(shape)
+
+        # Write the final instruction directly to out when possible
+        if self._result[0] == 'reg' and out is not None and \
+                out.dtype == self._dtype and out.shape == shape:
+            regs = list(regs)
+            regs[self._result[1]] = out
+
+        def value(operand):
+            if operand[0] == 'reg':
+                return regs[operand[1]]
+            if operand[0] == 'input':
+                return inputs[operand[1]]
+            return operand[1]
+
+        with np.errstate(all='ignore'):
+            for (func, reg, args, needs_scratch) in self._program:
+                if needs_scratch:
+                    func(*[value(a) for a in args], out=regs[reg],
+                        scratch=scratch)
+                elif func in _LOGICAL_FUNCS:
+                    func(*[value(a) for a in args], out=regs[reg],
+                        casting='unsafe')
+                else:
+                    func(*[value(a) for a in args], out=regs[reg],
+                        **self._arith_kwargs)
+
+        result = value(self._result)
+        if out is None:
+            if self._result[0] == 'reg':
+                out = result
+            else:
+                out = regs[0] if regs else np.empty(shape, self._dtype)
+                np.copyto(out, result, casting='unsafe')
+        elif result is not out:
+            np.copyto(out, result, casting='unsafe')
+
+        if self._nodata is not None:
+            np.isfinite(out, out=nodata_mask)
+            np.logical_not(nodata_mask, out=nodata_mask)
+            for (name, nodata) in (input_nodata or {}).items():
+                if name in self._names and nodata is not None:
+                    np.equal(inputs[name], nodata, out=scratch)
+                    nodata_mask |= scratch
+            if mask is not None:
+                nodata_mask |= mask
+            np.copyto(out, self._nodata, where=nodata_mask,
+                casting='unsafe')
+        return out
+
+
+def _get_expression(expression, nodata, dtype):
+    """
+    Compile expression if needed.  For a compiled Expression, nodata and
+    dtype must be None or match its own values.
+    """
+    if not isinstance(expression, Expression):
+        if dtype is None:
+            dtype = np.float32
+        return Expression(expression, dtype=dtype, nodata=nodata)
+    if nodata is not None and nodata != expression.nodata:
+        err_str = 'nodata %r conflicts with the expression nodata %r' % (
+            nodata, expression.nodata)
+        raise ExpressionError(err_str)
+    if dtype is not None and np.dtype(dtype) != expression.dtype:
+        err_str = 'dtype %s conflicts with the expression dtype %s' % (
+            np.dtype(dtype), expression.dtype)
+        raise ExpressionError(err_str)
+    return expression
+
+
+def _get_stack(expression, datasets, chunk_size, method):
+    """
+    Build a RasterStack over the datasets used by an expression and return
+    it with the stack layer, nodata value and envelope of each name
+    """
+    names = expression.names
+    if not names:
+        err_str = 'Expression does not reference any rasters'
+        raise ExpressionError(err_str)
+    missing = set(names).difference(datasets)
+    if missing:
+        err_str = 'Missing inputs: %s' % ', '.join(sorted(missing))
+        raise ExpressionError(err_str)
+
+    raster_stack = stack.RasterStack([datasets[n] for n in names],
+        method=method, chunk_size=chunk_size)
+
+    # Index of the first band of each dataset in the stack
+    layers = []
+    input_nodata = {}
+    n_layers = 0
+    for name in names:
+        layers.append(n_layers)
+        n_layers += datasets[name].RasterCount
+        input_nodata[name] = datasets[name].GetRasterBand(1).GetNoDataValue()
+    envs = [envelope.RasterEnvelope.from_gdal_dataset(datasets[n])
+        for n in names]
+    return (raster_stack, layers, input_nodata, envs)
+
+
+def _get_footprint_mask(chunk_re, envs, out):
+    """
+    Set the cells of chunk_re that fall outside any of envs in a boolean
+    array.  Returns None if every envelope covers the chunk.
+    """
+    mask = None
+    for env in envs:
+        (x_off, y_off) = envelope.get_grid_offset(env, chunk_re)
+        x_start = max(-x_off, 0)
+        y_start = max(-y_off, 0)
+        x_end = min(env.x_size - x_off, chunk_re.x_size)
+        y_end = min(env.y_size - y_off, chunk_re.y_size)
+        if x_start == 0 and y_start == 0 and x_end == chunk_re.x_size and \
+                y_end == chunk_re.y_size:
+            continue
+        if mask is None:
+            mask = out
+            mask[:] = False
+        if x_start >= x_end or y_start >= y_end:
+            mask[:] = True
+            break
+        mask[:y_start] = True
+        mask[y_end:] = True
+        mask[:, :x_start] = True
+        mask[:, x_end:] = True
+    return mask
+
+
+def _iter_chunks(expression, raster_stack, layers, input_nodata, envs):
+    """
+    Evaluate an expression over each chunk of a RasterStack, reusing one
+    set of input, output and mask buffers per chunk shape
+    """
+    names = expression.names
+    buffers = {}
+    for chunk_re in raster_stack.get_chunks():
+        shape = (len(layers), chunk_re.y_size, chunk_re.x_size)
+        if shape not in buffers:
+            buffers[shape] = (np.empty(shape, dtype=raster_stack.dtype),
+                np.empty(shape[1:], dtype=expression.dtype),
+                np.empty(shape[1:], dtype=bool))
+        (data, result, footprint) = buffers[shape]
+        raster_stack.read_window(chunk_re, layers=layers, out=data)
+        inputs = dict((n, data[i]) for (i, n) in enumerate(names))
+        mask = _get_footprint_mask(chunk_re, envs, footprint)
+        yield (chunk_re, expression.evaluate(inputs, out=result,
+            input_nodata=input_nodata, mask=mask))
+
+
+def iter_evaluate(expression, datasets, chunk_size=(256, 256),
+        method='min', nodata=None, dtype=None):
+    """
+    Evaluate an expression over named rasters one chunk at a time.  The
+    rasters are aligned with a RasterStack and only the layers used by the
+    expression are read.
+
+    Parameters
+    ----------
+    expression : str or Expression
+        The expression to evaluate.  For a compiled Expression, nodata and
+        dtype are taken from it and must not conflict with the arguments
+
+    datasets : dict
+        gdal.Dataset instances keyed by name.  The first band of each
+        dataset is used
+
+    chunk_size : tuple
+        (y_size, x_size) of chunks
+
+    method : str
+        Either 'min' or 'max'; see RasterStack
+
+    nodata : number
+        Output nodata value.  Cells equal to an input's nodata value,
+        outside an input's footprint (with method 'max') or with non-finite
+        results are set to this.  If None, cells outside a footprint are
+        evaluated with the stack's fill values
+
+    dtype : numpy.dtype
+        Data type of the evaluation.  Defaults to float32
+
+    Returns
+    -------
+    chunks : generator
+        Generator of (chunk_envelope, array) tuples.  The array is reused
+        between chunks of the same shape; copy it to keep it
+    """
+    expression = _get_expression(expression, nodata, dtype)
+    (raster_stack, layers, input_nodata, envs) = _get_stack(expression,
+        datasets, chunk_size, method)
+    return _iter_chunks(expression, raster_stack, layers, input_nodata,
+        envs)
+
+
+def evaluate_to_file(expression, datasets, path, chunk_size=(256, 256),
+        method='min', nodata=None, dtype=None, **writer_kwargs):
+    """
+    Evaluate an expression over named rasters and stream the result to a
+    tiled GeoTIFF
+
+    Parameters
+    ----------
+    expression : str or Expression
+        The expression to evaluate.  For a compiled Expression, nodata and
+        dtype are taken from it and must not conflict with the arguments
+
+    datasets : dict
+        gdal.Dataset instances keyed by name.  The first band of each
+        dataset is used
+
+    path : str
+        Output file name
+
+    chunk_size : tuple
+        (y_size, x_size) of chunks
+
+    method : str
+        Either 'min' or 'max'; see RasterStack
+
+    nodata : number
+        Output nodata value
+
+    dtype : numpy.dtype
+        Data type of the evaluation and output.  Defaults to float32
+
+    writer_kwargs : dict
+        Additional keyword arguments passed to TiledWriter
+
+    Returns
+    -------
+    raster_env : RasterEnvelope
+        Envelope of the output raster
+    """
+    expression = _get_expression(expression, nodata, dtype)
+    (raster_stack, layers, input_nodata, envs) = _get_stack(expression,
+        datasets, chunk_size, method)
+    projection = datasets[expression.names[0]].GetProjection()
+    with writer.TiledWriter(path, raster_stack.envelope,
+            dtype=expression.dtype, nodata=expression.nodata,
+            projection=projection,
+            **writer_kwargs) as out:
+        for (chunk_re, arr) in _iter_chunks(expression, raster_stack,
+                layers, input_nodata, envs):
+            out.write(chunk_re, arr)
+    return raster_stack.envelope
@@ -0,0 +1,358 @@
+"""
+Shared cache of decoded raster blocks.  Windowed reads are assembled from
+the natural blocks of each dataset so that overlapping windows (e.g. plot
+windows or focal halos) only read and decompress each block once.
+"""
+
+import collections
+import threading
+
+import numpy as np
+from osgeo import gdal, gdalconst
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import stack
+
+
+class BlockCacheError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+class BlockCache(object):
+    """
+    A thread-safe, byte-budgeted LRU cache of numpy arrays keyed by
+    (dataset path, band number, block envelope key)
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize an empty BlockCache
+
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum total size of cached blocks
+        """
+        self._max_bytes = max_bytes
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._n_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        """
+        Number of cached blocks
+        """
+        return len(self._blocks)
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def n_bytes(self):
+        return self._n_bytes
+
+    @property
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'n_blocks': len(self._blocks),
+                'n_bytes': self._n_bytes,
+                'hit_rate': float(self._hits) / total if total else 0.0,
+            }
+    # pylint: enable=missing-docstring
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Change the byte budget, evicting blocks if necessary
+        """
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove least-recently-used blocks until within budget.  The lock
+        must be held by the caller.
+        """
+        while self._n_bytes > self._max_bytes and self._blocks:
+            (_, arr) = self._blocks.popitem(last=False)
+            self._n_bytes -= arr.nbytes
+            self._evictions += 1
+
+    def get(self, key):
+        """
+        Return the block stored under key, or None if not present
+        """
+        with self._lock:
+            arr = self._blocks.get(key)
+            if arr is None:
+                self._misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self._hits += 1
+            return arr
+
+    def put(self, key, arr):
+        """
+        Store a block under key.  Blocks larger than the whole budget are
+        not cached.  Stored arrays are made read-only since they are shared
+        between readers.
+        """
+        if arr.nbytes > self._max_bytes:
+            return
+        arr.flags.writeable = False
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._n_bytes -= old.nbytes
+            self._blocks[key] = arr
+            self._n_bytes += arr.nbytes
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all blocks and reset statistics
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._n_bytes = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+
+# Process-wide cache shared by all readers unless one is given explicitly
+_block_cache = BlockCache()
+
+
+def get_block_cache():
+    """
+    Return the process-wide BlockCache
+    """
+    return _block_cache
+
+
+class CachedReader(object):
+    """
+    A CachedReader reads arbitrary windows from a raster file by assembling
+    its natural blocks, which are fetched from and stored in a BlockCache.
+    GDAL dataset handles are opened per thread since they are not safe to
+    share between threads.
+    """
+
+    def __init__(self, path, cache=None):
+        """
+        Initialize a CachedReader
+
+        Parameters
+        ----------
+        path : str
+            Raster file name
+
+        cache : BlockCache
+            Cache to use.  Defaults to the process-wide cache
+        """
+        self._path = path
+        self._cache = cache if cache is not None else get_block_cache()
+        self._local = threading.local()
+
+        ds = self._get_dataset()
+        self._envelope = envelope.RasterEnvelope.from_gdal_dataset(ds)
+        self._band_count = ds.RasterCount
+        band = ds.GetRasterBand(1)
+        self._dtype = stack.get_band_dtype(band)
+        (self._block_x_size, self._block_y_size) = band.GetBlockSize()
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def envelope(self):
+        return self._envelope
+
+    @property
+    def block_size(self):
+        return (self._block_x_size, self._block_y_size)
+
+    @property
+    def cache(self):
+        return self._cache
+    # pylint: enable=missing-docstring
+
+    def _get_dataset(self):
+        """
+        Return this thread's dataset handle, opening it if necessary
+        """
+        ds = getattr(self._local, 'ds', None)
+        if ds is None:
+            ds = gdal.Open(self._path, gdalconst.GA_ReadOnly)
+            if ds is None:
+                err_str = 'Unable to open %s' % self._path
+                raise BlockCacheError(err_str)
+            self._local.ds = ds
+        return ds
+
+    def get_block_envelope(self, block_col, block_row):
+        """
+        Return the snapped envelope of a block, truncated at the raster
+        edges
+
+        Parameters
+        ----------
+        block_col : int
+            Block column
+
+        block_row : int
+            Block row
+
+        Returns
+        -------
+        block_re : RasterEnvelope
+            Envelope of the block
+        """
+        x_off = block_col * self._block_x_size
+        y_off = block_row * self._block_y_size
+        x_size = min(self._block_x_size, self._envelope.x_size - x_off)
+        y_size = min(self._block_y_size, self._envelope.y_size - y_off)
+        return self._envelope.get_window(x_off, y_off, x_size, y_size)
+
+    def get_block(self, band_num, block_col, block_row):
+        """
+        Return a decoded block, reading it from disk on a cache miss
+
+        Parameters
+        ----------
+        band_num : int
+            Band number (starting at 1)
+
+        block_col : int
+            Block column
+
+        block_row : int
+            Block row
+
+        Returns
+        -------
+        arr : numpy.ndarray
+            Read-only block array
+        """
+        block_re = self.get_block_envelope(block_col, block_row)
+        key = (self._path, band_num, block_re.get_key())
+        arr = self._cache.get(key)
+        if arr is None:
+            x_off = block_col * self._block_x_size
+            y_off = block_row * self._block_y_size
+            band = self._get_dataset().GetRasterBand(band_num)
+            arr = band.ReadAsArray(x_off, y_off, block_re.x_size,
+                block_re.y_size)
+            self._cache.put(key, arr)
+        return arr
+
+    def read(self, env, band_num=1, fill_value=0):
+        """
+        Read the window that minimally covers env.  Cells outside of the
+        raster are set to fill_value.
+
+        Parameters
+        ----------
+        env : Envelope
+            The area to read
+
+        band_num : int
+            Band number (starting at 1)
+
+        fill_value : number
+            Value for cells outside of the raster
+
+        Returns
+        -------
+        (window_re, arr) : tuple
+            The snapped window envelope and its array
+        """
+        # Snap the upper-left corner with get_offset_from_xy and grow the
+        # window to cover the lower-right corner
+        (x_off, y_off) = self._envelope.get_offset_from_xy(env.x_min,
+            env.y_max)
+        (x_end, y_end) = self._envelope.get_offset_from_xy(env.x_max,
+            env.y_min)
+        (x_max, y_min) = self._envelope.get_xy_from_offset(x_end, y_end)
+        if x_max - env.x_max < -envelope.PRECISION:
+            x_end += 1
+        if env.y_min - y_min < -envelope.PRECISION:
+            y_end += 1
+        x_end = max(x_end, x_off + 1)
+        y_end = max(y_end, y_off + 1)
+        return (self._envelope.get_window(x_off, y_off, x_end - x_off,
+            y_end - y_off), self.read_offsets(x_off, y_off, x_end - x_off,
+            y_end - y_off, band_num=band_num, fill_value=fill_value))
+
+    def read_offsets(self, x_off, y_off, x_size, y_size, band_num=1,
+            fill_value=0):
+        """
+        Read a window given as cell offsets into the raster.  The window may
+        extend past the raster edges; those cells are set to fill_value.
+
+        Parameters
+        ----------
+        x_off, y_off : int
+            Column and row offset of the upper-left cell
+
+        x_size, y_size : int
+            Number of columns and rows
+
+        band_num : int
+            Band number (starting at 1)
+
+        fill_value : number
+            Value for cells outside of the raster
+
+        Returns
+        -------
+        arr : numpy.ndarray
+            Array of shape (y_size, x_size).  Its type is the band type,
+            promoted if needed to hold fill_value
+        """
+        if band_num < 1 or band_num > self._band_count:
+            err_str = 'Invalid band number %d' % band_num
+            raise BlockCacheError(err_str)
+
+        x_start = max(x_off, 0)
+        y_start = max(y_off, 0)
+        x_stop = min(x_off + x_size, self._envelope.x_size)
+        y_stop = min(y_off + y_size, self._envelope.y_size)
+
+        dtype = np.result_type(self._dtype, stack.get_fill_dtype(fill_value))
+        out = np.full((y_size, x_size), fill_value, dtype=dtype)
+        if x_start < x_stop and y_start < y_stop:
+            for block_row in range(y_start // self._block_y_size,
+                    (y_stop - 1) // self._block_y_size + 1):
+                for block_col in range(x_start // self._block_x_size,
+                        (x_stop - 1) // self._block_x_size + 1):
+                    block = self.get_block(band_num, block_col, block_row)
+
+                    # Overlap of the block and the window in raster space
+                    bx0 = block_col * self._block_x_size
+                    by0 = block_row * self._block_y_size
+                    cx0 = max(x_start, bx0)
+                    cy0 = max(y_start, by0)
+                    cx1 = min(x_stop, bx0 + block.shape[1])
+                    cy1 = min(y_stop, by0 + block.shape[0])
+                    out[cy0 - y_off:cy1 - y_off, cx0 - x_off:cx1 - x_off] = \
+                        block[cy0 - by0:cy1 - by0, cx0 - bx0:cx1 - bx0]
+        return out
@@ -0,0 +1,341 @@
+"""
+Raster catalog.  Scans directory trees for raster files in parallel, reading
+only their headers, and persists their envelopes and basic properties in a
+SQLite index that can be queried spatially.  Rescans are incremental: only
+files whose modification time or size changed are reopened.
+"""
+
+import collections
+import concurrent.futures
+import math
+import os
+import sqlite3
+
+from osgeo import gdal, gdalconst
+
+from spatial_tools.raster import envelope
+
+DEFAULT_EXTENSIONS = ('.tif', '.tiff', '.img')
+
+CatalogEntry = collections.namedtuple('CatalogEntry', [
+    'path', 'envelope', 'band_count', 'dtype', 'signature'])
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rasters (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        x_min REAL NOT NULL,
+        y_min REAL NOT NULL,
+        x_max REAL NOT NULL,
+        y_max REAL NOT NULL,
+        cell_size REAL NOT NULL,
+        x_size INTEGER NOT NULL,
+        y_size INTEGER NOT NULL,
+        band_count INTEGER NOT NULL,
+        dtype TEXT NOT NULL,
+        signature TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS rasters_bounds
+        ON rasters (x_min, x_max, y_min, y_max);
+    CREATE INDEX IF NOT EXISTS rasters_signature ON rasters (signature);
+'''
+
+_COLUMNS = ('path', 'mtime_ns', 'size', 'x_min', 'y_min', 'x_max', 'y_max',
+    'cell_size', 'x_size', 'y_size', 'band_count', 'dtype', 'signature')
+
+
+class CatalogError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_grid_signature(raster_env):
+    """
+    Return a string identifying the grid of a RasterEnvelope.  Envelopes
+    with the same signature share a cell size and are snapped to each
+    other, so they can be combined without resampling.
+
+    Parameters
+    ----------
+    raster_env : RasterEnvelope
+        The envelope for which to compute a signature
+
+    Returns
+    -------
+    signature : str
+        Cell size and origin offsets modulo the cell size
+    """
+    cell_size = raster_env.cell_size
+    digits = int(round(-math.log10(envelope.PRECISION)))
+
+    def _origin(coord):
+        offset = round(math.fmod(coord, cell_size), digits)
+        if offset < 0:
+            offset = round(offset + cell_size, digits)
+        if math.fabs(offset - cell_size) <= envelope.PRECISION:
+            offset = 0.0
+        return offset + 0.0
+
+    return '%r:%r:%r' % (round(cell_size, digits) + 0.0,
+        _origin(raster_env.x_min), _origin(raster_env.y_max))
+
+
+def read_header(path):
+    """
+    Open a raster and return its catalog record.  Only the header is read.
+
+    Parameters
+    ----------
+    path : str
+        The raster file name
+
+    Returns
+    -------
+    record : dict
+        Values for each catalog column
+    """
+    stat = os.stat(path)
+    ds = gdal.Open(path, gdalconst.GA_ReadOnly)
+    if ds is None:
+        err_str = 'Unable to open %s' % path
+        raise CatalogError(err_str)
+    raster_env = envelope.RasterEnvelope.from_gdal_dataset(ds)
+    band_count = ds.RasterCount
+    if band_count:
+        dtype = gdal.GetDataTypeName(ds.GetRasterBand(1).DataType)
+    else:
+        dtype = ''
+    ds = None
+
+    return {
+        'path': path,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'x_min': raster_env.x_min,
+        'y_min': raster_env.y_min,
+        'x_max': raster_env.x_max,
+        'y_max': raster_env.y_max,
+        'cell_size': raster_env.cell_size,
+        'x_size': raster_env.x_size,
+        'y_size': raster_env.y_size,
+        'band_count': band_count,
+        'dtype': dtype,
+        'signature': get_grid_signature(raster_env),
+    }
+
+
+def find_rasters(directories, extensions=DEFAULT_EXTENSIONS):
+    """
+    Walk one or more directory trees and return raster file names
+
+    Parameters
+    ----------
+    directories : sequence
+        List or tuple of directories to search
+
+    extensions : sequence
+        File extensions (case-insensitive) to include
+
+    Returns
+    -------
+    paths : list
+        Sorted list of absolute file names
+    """
+    extensions = tuple(e.lower() for e in extensions)
+    paths = []
+    for directory in directories:
+        for (dir_path, _, file_names) in os.walk(directory):
+            for file_name in file_names:
+                if file_name.lower().endswith(extensions):
+                    paths.append(
+                        os.path.abspath(os.path.join(dir_path, file_name)))
+    return sorted(paths)
+
+
+class RasterCatalog(object):
+    """
+    A RasterCatalog is a persistent index of raster envelopes backed by a
+    SQLite database
+    """
+
+    def __init__(self, db_path):
+        """
+        Open (or create) a catalog
+
+        Parameters
+        ----------
+        db_path : str
+            File name of the SQLite database
+        """
+        self._db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(_SCHEMA)
+        self._failed = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """
+        Number of rasters in the catalog
+        """
+        return self._conn.execute('SELECT COUNT(*) FROM rasters').fetchone()[0]
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def db_path(self):
+        return self._db_path
+
+    @property
+    def failed(self):
+        return dict(self._failed)
+    # pylint: enable=missing-docstring
+
+    def close(self):
+        """
+        Close the underlying database connection
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def scan(self, directories, extensions=DEFAULT_EXTENSIONS, n_workers=8,
+            use_processes=False):
+        """
+        Scan directory trees and update the catalog.  Only new files and
+        files whose modification time or size changed are opened; files
+        that no longer exist, or that changed and can no longer be read,
+        are removed.
+
+        Parameters
+        ----------
+        directories : sequence
+            List or tuple of directories to search
+
+        extensions : sequence
+            File extensions (case-insensitive) to include
+
+        n_workers : int
+            Number of concurrent header readers
+
+        use_processes : bool
+            Use a process pool instead of a thread pool
+
+        Returns
+        -------
+        counts : dict
+            Number of 'added', 'updated', 'removed', 'unchanged' and
+            'failed' files
+        """
+        counts = dict.fromkeys(
+            ('added', 'updated', 'removed', 'unchanged', 'failed'), 0)
+        roots = [os.path.abspath(d) for d in directories]
+        known = dict((row[0], (row[1], row[2])) for row in
+            self._conn.execute('SELECT path, mtime_ns, size FROM rasters'))
+
+        # Find files needing a (re)read
+        paths = find_rasters(roots, extensions=extensions)
+        to_read = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                counts['unchanged'] += 1
+            else:
+                to_read.append(path)
+
+        # Remove entries under the scanned roots that have disappeared
+        found = set(paths)
+        removed = [p for p in known if p not in found and
+            any(p.startswith(os.path.join(r, '')) for r in roots)]
+        with self._conn:
+            self._conn.executemany('DELETE FROM rasters WHERE path = ?',
+                [(p,) for p in removed])
+        counts['removed'] = len(removed)
+
+        # Read headers concurrently and insert as they complete
+        if use_processes:
+            executor_cls = concurrent.futures.ProcessPoolExecutor
+        else:
+            executor_cls = concurrent.futures.ThreadPoolExecutor
+        insert_sql = 'INSERT OR REPLACE INTO rasters (%s) VALUES (%s)' % (
+            ', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS)))
+        with executor_cls(max_workers=n_workers) as executor:
+            futures = dict((executor.submit(read_header, p), p)
+                for p in to_read)
+            with self._conn:
+                for future in concurrent.futures.as_completed(futures):
+                    path = futures[future]
+                    try:
+                        record = future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        self._failed[path] = str(e)
+                        counts['failed'] += 1
+                        # Drop the stale entry of a changed file
+                        if path in known:
+                            self._conn.execute(
+                                'DELETE FROM rasters WHERE path = ?',
+                                (path,))
+                        continue
+                    self._failed.pop(path, None)
+                    self._conn.execute(insert_sql,
+                        [record[c] for c in _COLUMNS])
+                    if path in known:
+                        counts['updated'] += 1
+                    else:
+                        counts['added'] += 1
+        return counts
+
+    def _to_entry(self, row):
+        """
+        Convert a database row to a CatalogEntry
+        """
+        record = dict(zip(_COLUMNS, row))
+        raster_env = envelope.RasterEnvelope.from_origin(record['x_min'],
+            record['y_max'], record['cell_size'], record['x_size'],
+            record['y_size'])
+        return CatalogEntry(record['path'], raster_env,
+            record['band_count'], record['dtype'], record['signature'])
+
+    def query(self, env=None, signature=None):
+        """
+        Return catalog entries that overlap an envelope and/or share a grid
+        signature
+
+        Parameters
+        ----------
+        env : Envelope
+            Area of interest.  Entries that only touch env are excluded
+
+        signature : str
+            Grid signature to match (see get_grid_signature)
+
+        Returns
+        -------
+        entries : list
+            List of CatalogEntry tuples sorted by path
+        """
+        sql = 'SELECT %s FROM rasters' % ', '.join(_COLUMNS)
+        clauses = []
+        params = []
+        if env is not None:
+            clauses.append('x_min < ? AND x_max > ? AND y_min < ? AND '
+                'y_max > ?')
+            params.extend([env.x_max, env.x_min, env.y_max, env.y_min])
+        if signature is not None:
+            clauses.append('signature = ?')
+            params.append(signature)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY path'
+        return [self._to_entry(row) for row in
+            self._conn.execute(sql, params)]
@@ -0,0 +1,252 @@
+"""
+Space-filling curve ordering of tiles, envelopes and points.  Keys along a
+Hilbert or Morton (Z-order) curve keep spatially close items close in
+sort order, which improves cache locality when traversing tiles and keeps
+partitions of work spatially compact.
+"""
+
+import numpy as np
+
+from spatial_tools.raster import envelope
+
+CURVES = ('hilbert', 'morton')
+
+# Keys must fit in a signed 64-bit integer
+MAX_ORDER = 31
+
+
+def _check_order(order):
+    """
+    Ensure the curve order is valid
+    """
+    if order < 1 or order > MAX_ORDER:
+        err_str = 'Order must be between 1 and %d' % MAX_ORDER
+        raise envelope.EnvelopeError(err_str)
+
+
+def _spread_bits(v):
+    """
+    Insert a zero bit between each of the lower 32 bits of v
+    """
+    v = v & np.int64(0x00000000FFFFFFFF)
+    v = (v | (v << 16)) & np.int64(0x0000FFFF0000FFFF)
+    v = (v | (v << 8)) & np.int64(0x00FF00FF00FF00FF)
+    v = (v | (v << 4)) & np.int64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << 2)) & np.int64(0x3333333333333333)
+    v = (v | (v << 1)) & np.int64(0x5555555555555555)
+    return v
+
+
+def morton_key(x, y):
+    """
+    Return the Morton (Z-order) key of integer grid coordinates by
+    interleaving their bits, x in the lowest bit
+
+    Parameters
+    ----------
+    x : int or array-like
+        Column coordinate(s) in [0, 2 ** 31)
+
+    y : int or array-like
+        Row coordinate(s) in [0, 2 ** 31)
+
+    Returns
+    -------
+    key : numpy.int64 or numpy.ndarray
+        Morton key(s)
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+
+def hilbert_key(x, y, order):
+    """
+    Return the distance along a Hilbert curve that fills a
+    2 ** order x 2 ** order grid
+
+    Parameters
+    ----------
+    x : int or array-like
+        Column coordinate(s) in [0, 2 ** order)
+
+    y : int or array-like
+        Row coordinate(s) in [0, 2 ** order)
+
+    order : int
+        Curve order
+
+    Returns
+    -------
+    key : numpy.int64 or numpy.ndarray
+        Hilbert key(s)
+    """
+    _check_order(order)
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    n = np.int64(1) << order
+    key = np.zeros(np.broadcast(x, y).shape, dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        key += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+
+        # Rotate the quadrant so the sub-curve has the right orientation
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ~ry
+        (x, y) = (np.where(swap, y, x), np.where(swap, x, y))
+        s >>= 1
+    return key
+
+
+def get_point_keys(x, y, parent_env, curve='hilbert', order=16):
+    """
+    Return curve keys for points relative to a parent extent.  The extent
+    is divided into a 2 ** order x 2 ** order grid and each point is keyed
+    by the grid cell it falls in.  Points outside the extent are clamped to
+    its edge.
+
+    Parameters
+    ----------
+    x : array-like
+        X coordinates
+
+    y : array-like
+        Y coordinates
+
+    parent_env : Envelope
+        Extent over which the curve is laid out
+
+    curve : str
+        Either 'hilbert' or 'morton'
+
+    order : int
+        Curve order
+
+    Returns
+    -------
+    keys : numpy.ndarray
+        Curve keys
+    """
+    if curve not in CURVES:
+        err_str = 'Curve must be one of %s' % ', '.join(CURVES)
+        raise envelope.EnvelopeError(err_str)
+    _check_order(order)
+
+    n = 1 << order
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    col = (x - parent_env.x_min) / (parent_env.x_max - parent_env.x_min)
+    row = (parent_env.y_max - y) / (parent_env.y_max - parent_env.y_min)
+    col = np.clip(np.floor(col * n), 0, n - 1).astype(np.int64)
+    row = np.clip(np.floor(row * n), 0, n - 1).astype(np.int64)
+    if curve == 'hilbert':
+        return hilbert_key(col, row, order)
+    return morton_key(col, row)
+
+
+def get_envelope_keys(envs, parent_env, curve='hilbert', order=16):
+    """
+    Return curve keys for the centroids of envelopes (or RasterEnvelope
+    tiles) relative to a parent extent
+
+    Parameters
+    ----------
+    envs : sequence
+        List or tuple of Envelope instances
+
+    parent_env : Envelope
+        Extent over which the curve is laid out
+
+    curve : str
+        Either 'hilbert' or 'morton'
+
+    order : int
+        Curve order.  Tiles of a grid get distinct keys as long as
+        2 ** order is at least the number of tiles along each axis
+
+    Returns
+    -------
+    keys : numpy.ndarray
+        Curve keys, one per envelope
+    """
+    x = [(e.x_min + e.x_max) / 2.0 for e in envs]
+    y = [(e.y_min + e.y_max) / 2.0 for e in envs]
+    return get_point_keys(x, y, parent_env, curve=curve, order=order)
+
+
+def sort_by_curve(envs, parent_env, curve='hilbert', order=16):
+    """
+    Return envelopes sorted along a space-filling curve.  Ties keep their
+    original order.
+
+    Parameters
+    ----------
+    envs : sequence
+        List or tuple of Envelope instances
+
+    parent_env : Envelope
+        Extent over which the curve is laid out
+
+    curve : str
+        Either 'hilbert' or 'morton'
+
+    order : int
+        Curve order
+
+    Returns
+    -------
+    sorted_envs : list
+        Envelopes in curve order
+    """
+    envs = list(envs)
+    if not envs:
+        return []
+    keys = get_envelope_keys(envs, parent_env, curve=curve, order=order)
+    return [envs[i] for i in np.argsort(keys, kind='stable')]
+
+
+def partition_by_curve(envs, parent_env, n_parts, curve='hilbert',
+        order=16):
+    """
+    Split envelopes into spatially compact groups by cutting the curve
+    order into n_parts contiguous runs of (nearly) equal size
+
+    Parameters
+    ----------
+    envs : sequence
+        List or tuple of Envelope instances
+
+    parent_env : Envelope
+        Extent over which the curve is laid out
+
+    n_parts : int
+        Number of groups
+
+    curve : str
+        Either 'hilbert' or 'morton'
+
+    order : int
+        Curve order
+
+    Returns
+    -------
+    parts : list
+        List of n_parts lists of envelopes.  Groups may be empty if there
+        are fewer envelopes than parts
+    """
+    if n_parts < 1:
+        err_str = 'Number of parts must be positive'
+        raise envelope.EnvelopeError(err_str)
+    sorted_envs = sort_by_curve(envs, parent_env, curve=curve, order=order)
+    (size, extra) = divmod(len(sorted_envs), n_parts)
+    parts = []
+    start = 0
+    for i in range(n_parts):
+        end = start + size + (1 if i < extra else 0)
+        parts.append(sorted_envs[start:end])
+        start = end
+    return parts
@@ -0,0 +1,116 @@
+"""
+Dirty-region tracking for incremental reprocessing.  Changed areas are
+accumulated as envelopes and resolved to the minimal set of tiles of a
+snapped tile grid that need to be recomputed.
+"""
+
+from spatial_tools.raster import envelope
+
+
+class DirtyRegionTracker(object):
+    """
+    A DirtyRegionTracker accumulates changed envelopes over a RasterEnvelope
+    that is split into fixed-size tiles (see get_tiles).  Each change is
+    resolved to the tiles it touches as it is added, and dirty tiles are
+    reported in the same row-major order used by get_tiles.
+    """
+
+    def __init__(self, raster_env, tile_x_size, tile_y_size=None):
+        """
+        Initialize a DirtyRegionTracker over a tile grid
+
+        Parameters
+        ----------
+        raster_env : RasterEnvelope
+            The full extent of the product
+
+        tile_x_size : int
+            Number of columns in each tile
+
+        tile_y_size : int
+            Number of rows in each tile.  Defaults to tile_x_size
+        """
+        if tile_y_size is None:
+            tile_y_size = tile_x_size
+        if tile_x_size <= 0 or tile_y_size <= 0:
+            err_str = 'Tile dimensions must be positive'
+            raise envelope.EnvelopeError(err_str)
+
+        self._raster_env = raster_env
+        self._tile_x_size = tile_x_size
+        self._tile_y_size = tile_y_size
+        self._tiles = set()
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def raster_env(self):
+        return self._raster_env
+    # pylint: enable=missing-docstring
+
+    def __len__(self):
+        """
+        Number of dirty tiles
+        """
+        return len(self._tiles)
+
+    def add(self, env):
+        """
+        Mark an envelope as changed.  Envelopes that do not overlap the
+        tile grid are ignored.
+
+        Parameters
+        ----------
+        env : Envelope
+            The changed area
+        """
+        (x_start, y_start, x_end, y_end) = \
+            envelope.get_cell_range(self._raster_env, env)
+        if x_start >= x_end or y_start >= y_end:
+            return
+
+        for row in range(y_start // self._tile_y_size,
+                (y_end - 1) // self._tile_y_size + 1):
+            for col in range(x_start // self._tile_x_size,
+                    (x_end - 1) // self._tile_x_size + 1):
+                self._tiles.add((row, col))
+
+    def get_tile(self, row, col):
+        """
+        Return the envelope of the tile at a given tile row and column
+
+        Parameters
+        ----------
+        row : int
+            Tile row
+
+        col : int
+            Tile column
+
+        Returns
+        -------
+        tile_re : RasterEnvelope
+            Envelope of the tile, truncated at the grid edges
+        """
+        x_off = col * self._tile_x_size
+        y_off = row * self._tile_y_size
+        x_size = min(self._tile_x_size, self._raster_env.x_size - x_off)
+        y_size = min(self._tile_y_size, self._raster_env.y_size - y_off)
+        return self._raster_env.get_window(x_off, y_off, x_size, y_size)
+
+    def get_dirty_tiles(self):
+        """
+        Return the envelopes of all tiles touched by a dirty region
+
+        Returns
+        -------
+        tiles : list
+            Row-major list of RasterEnvelope instances
+        """
+        return [self.get_tile(row, col) for (row, col) in sorted(self._tiles)]
+
+    def clear(self):
+        """
+        Reset the tracker once dirty tiles have been reprocessed
+        """
+        self._tiles = set()
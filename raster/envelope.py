@@ -164,6 +164,33 @@ class Envelope(object):
         y_max = min(self.y_max, other.y_max)
         return Envelope(x_min, y_min, x_max, y_max)
 
+    def difference(self, other):
+        """
+        Difference method.  Returns a list of disjoint envelopes that
+        together cover the area of self not covered by other.  The list is
+        empty if self is a subset of other and contains only a copy of self
+        if the two do not overlap.  At most four envelopes are returned:
+        full-width bands above and below other and partial bands to the
+        left and right of other.
+        """
+        x_min = max(self.x_min, other.x_min)
+        y_min = max(self.y_min, other.y_min)
+        x_max = min(self.x_max, other.x_max)
+        y_max = min(self.y_max, other.y_max)
+        if x_min >= x_max or y_min >= y_max:
+            return [Envelope(self.x_min, self.y_min, self.x_max, self.y_max)]
+
+        pieces = []
+        if y_max < self.y_max:
+            pieces.append(Envelope(self.x_min, y_max, self.x_max, self.y_max))
+        if y_min > self.y_min:
+            pieces.append(Envelope(self.x_min, self.y_min, self.x_max, y_min))
+        if x_min > self.x_min:
+            pieces.append(Envelope(self.x_min, y_min, x_min, y_max))
+        if x_max < self.x_max:
+            pieces.append(Envelope(x_max, y_min, self.x_max, y_max))
+        return pieces
+
 
 class RasterEnvelope(Envelope):
     """
@@ -250,6 +277,34 @@ class RasterEnvelope(Envelope):
         y_min = y_max - (ds.RasterYSize * cell_size)
         return cls(x_min, y_min, x_max, y_max, cell_size)
 
+    @classmethod
+    def from_origin(cls, x_min, y_max, cell_size, x_size, y_size):
+        """
+        Create a RasterEnvelope from its upper-left corner, cell size and
+        number of columns and rows.  The sizes are used as given rather
+        than recomputed from floating-point coordinates.
+
+        Parameters
+        ----------
+        x_min : double
+            Minimum x coordinate
+
+        y_max : double
+            Maximum y coordinate
+
+        cell_size : double
+            Cell size within envelope
+
+        x_size : int
+            Number of columns
+
+        y_size : int
+            Number of rows
+        """
+        raster_env = cls(x_min, y_max - cell_size, x_min + cell_size, y_max,
+            cell_size)
+        return raster_env.get_window(0, 0, x_size, y_size)
+
     # Simple properties to return class attributes
     # pylint: disable=missing-docstring
     @property
@@ -353,6 +408,47 @@ class RasterEnvelope(Envelope):
             else:
                 return get_minimum_bounding_envelope(env, other)
 
+    def difference(self, other):
+        """
+        Return a list of disjoint RasterEnvelopes, snapped to self, that
+        cover the cells of self not completely covered by other.  Cells
+        only partially covered by other are retained.
+        """
+        (x_start, y_start, x_end, y_end) = \
+            get_cell_range(self, other, inside=True)
+        if x_start >= x_end or y_start >= y_end:
+            return [copy.copy(self)]
+
+        pieces = []
+        if y_start > 0:
+            pieces.append(self.get_window(0, 0, self.x_size, y_start))
+        if y_end < self.y_size:
+            pieces.append(self.get_window(0, y_end, self.x_size,
+                self.y_size - y_end))
+        if x_start > 0:
+            pieces.append(self.get_window(0, y_start, x_start,
+                y_end - y_start))
+        if x_end < self.x_size:
+            pieces.append(self.get_window(x_end, y_start,
+                self.x_size - x_end, y_end - y_start))
+        return pieces
+
+    def get_key(self):
+        """
+        Return a canonical, hashable representation of this envelope.  The
+        coordinates and cell size are rounded to PRECISION so that tiny
+        floating-point differences do not change the key.
+
+        Returns
+        -------
+        key : tuple
+            (x_min, y_max, cell_size, x_size, y_size)
+        """
+        digits = int(round(-math.log10(PRECISION)))
+        return (round(self.x_min, digits) + 0.0,
+            round(self.y_max, digits) + 0.0,
+            round(self.cell_size, digits) + 0.0, self.x_size, self.y_size)
+
     def get_offset_from_xy(self, x, y):
         """
         Return the offset (ie. column and row) based on an x, y coordinate
@@ -402,6 +498,45 @@ class RasterEnvelope(Envelope):
         return [self.x_min, self.cell_size, 0.0, self.y_max, 0.0,
             -self.cell_size]
 
+    def get_window(self, x_off, y_off, x_size, y_size):
+        """
+        Return a new RasterEnvelope that is snapped to self and covers the
+        window starting at the given column/row offset.  Coordinates are
+        derived from integer offsets rather than re-snapped to avoid
+        floating-point growth of the window.  The window is not required to
+        fall within self.
+
+        Parameters
+        ----------
+        x_off : int
+            X (column) offset of the upper-left cell of the window
+
+        y_off : int
+            Y (row) offset of the upper-left cell of the window
+
+        x_size : int
+            Number of columns in the window
+
+        y_size : int
+            Number of rows in the window
+
+        Returns
+        -------
+        window_re : RasterEnvelope
+            The envelope of the window
+        """
+        if x_size <= 0 or y_size <= 0:
+            err_str = 'Window dimensions must be positive'
+            raise EnvelopeError(err_str)
+        (x_min, y_max) = self.get_xy_from_offset(x_off, y_off)
+        (x_max, y_min) = \
+            self.get_xy_from_offset(x_off + x_size, y_off + y_size)
+        window_re = copy.copy(self)
+        window_re._x_min, window_re._y_min = x_min, y_min
+        window_re._x_max, window_re._y_max = x_max, y_max
+        window_re._x_size, window_re._y_size = x_size, y_size
+        return window_re
+
 
 def get_num_cells(coord_max, coord_min, cell_size):
     """
@@ -473,6 +608,90 @@ def calculate_snapped_envelope(env, cell_size):
     return (x_max, y_min, x_size, y_size)
 
 
+def get_grid_offset(src_env, dst_env):
+    """
+    Return the integer column and row offset of the upper-left corner of
+    dst_env within src_env.  Both envelopes must share the same grid.
+
+    Parameters
+    ----------
+    src_env : RasterEnvelope
+        The envelope providing the origin
+
+    dst_env : RasterEnvelope
+        The envelope for which to find the offset
+
+    Returns
+    -------
+    (x_off, y_off) : tuple
+        The X (column) and Y (row) offsets of dst_env into src_env
+    """
+    x_off = (dst_env.x_min - src_env.x_min) / src_env.cell_size
+    y_off = (src_env.y_max - dst_env.y_max) / src_env.cell_size
+    if math.fabs(x_off - round(x_off)) > PRECISION or \
+            math.fabs(y_off - round(y_off)) > PRECISION:
+        err_str = 'Envelopes are not aligned to the same grid'
+        raise EnvelopeError(err_str)
+    return (int(round(x_off)), int(round(y_off)))
+
+
+def get_cell_range(raster_env, env, inside=False):
+    """
+    Return the range of cell offsets of raster_env covered by env, clipped
+    to raster_env.  By default, any cell that env touches with a non-zero
+    area is included.  If inside is True, only cells completely covered by
+    env are included.  Coordinates within PRECISION of a cell boundary are
+    treated as lying on it.
+
+    Parameters
+    ----------
+    raster_env : RasterEnvelope
+        The envelope providing the grid
+
+    env : Envelope
+        The area of interest
+
+    inside : bool
+        Whether to only include completely covered cells
+
+    Returns
+    -------
+    (x_start, y_start, x_end, y_end) : tuple
+        Column and row offsets of the covered cells.  The end offsets are
+        exclusive; the range is empty if x_start >= x_end or
+        y_start >= y_end
+    """
+    def _floor(value):
+        nearest = round(value)
+        if math.fabs(value - nearest) <= PRECISION:
+            return int(nearest)
+        return int(math.floor(value))
+
+    def _ceil(value):
+        nearest = round(value)
+        if math.fabs(value - nearest) <= PRECISION:
+            return int(nearest)
+        return int(math.ceil(value))
+
+    cell_size = raster_env.cell_size
+    x_lo = (env.x_min - raster_env.x_min) / cell_size
+    x_hi = (env.x_max - raster_env.x_min) / cell_size
+    y_lo = (raster_env.y_max - env.y_max) / cell_size
+    y_hi = (raster_env.y_max - env.y_min) / cell_size
+    if inside:
+        (x_start, x_end) = (_ceil(x_lo), _floor(x_hi))
+        (y_start, y_end) = (_ceil(y_lo), _floor(y_hi))
+    else:
+        (x_start, x_end) = (_floor(x_lo), _ceil(x_hi))
+        (y_start, y_end) = (_floor(y_lo), _ceil(y_hi))
+
+    x_start = max(x_start, 0)
+    y_start = max(y_start, 0)
+    x_end = min(x_end, raster_env.x_size)
+    y_end = min(y_end, raster_env.y_size)
+    return (x_start, y_start, x_end, y_end)
+
+
 def get_minimum_bounding_envelope(bound_env, snap_re):
     """
     Given a bounding envelope, bound_env return a new RasterEnvelope that
@@ -572,3 +791,39 @@ def max_of(re_list, snap_re=None):
         max_env = max_re.union(re_list[i])
         max_re = get_minimum_bounding_envelope(max_env, snap_re)
     return max_re
+
+
+def get_tiles(raster_env, tile_x_size, tile_y_size=None):
+    """
+    Split a RasterEnvelope into a row-major list of snapped tiles.  Tiles
+    along the right and bottom edges are truncated to fit within raster_env.
+
+    Parameters
+    ----------
+    raster_env : RasterEnvelope
+        The envelope to split
+
+    tile_x_size : int
+        Number of columns in each tile
+
+    tile_y_size : int
+        Number of rows in each tile.  Defaults to tile_x_size
+
+    Returns
+    -------
+    tiles : list
+        List of RasterEnvelope instances covering raster_env
+    """
+    if tile_y_size is None:
+        tile_y_size = tile_x_size
+    if tile_x_size <= 0 or tile_y_size <= 0:
+        err_str = 'Tile dimensions must be positive'
+        raise EnvelopeError(err_str)
+
+    tiles = []
+    for y_off in range(0, raster_env.y_size, tile_y_size):
+        y_size = min(tile_y_size, raster_env.y_size - y_off)
+        for x_off in range(0, raster_env.x_size, tile_x_size):
+            x_size = min(tile_x_size, raster_env.x_size - x_off)
+            tiles.append(raster_env.get_window(x_off, y_off, x_size, y_size))
+    return tiles
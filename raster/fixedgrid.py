@@ -0,0 +1,313 @@
+# pylint: disable=too-many-arguments
+
+"""
+Fixed-point raster envelopes.  Coordinates and cell size are stored as
+integer multiples of a base unit (e.g. 0.001 for millimeters) so that
+snapping, set operations, equality and hashing are exact.  Conversion to
+and from floating-point RasterEnvelopes only happens at the edges.
+"""
+
+from spatial_tools.raster import envelope
+
+
+def to_units(value, unit):
+    """
+    Convert a floating-point coordinate to an integer number of units.
+    Raises an exception if value is not within PRECISION of a multiple of
+    unit.
+
+    Parameters
+    ----------
+    value : double
+        The coordinate to convert
+
+    unit : double
+        The base unit
+
+    Returns
+    -------
+    n_units : int
+        The coordinate as an integer multiple of unit
+    """
+    n_units = int(round(value / unit))
+    if abs(value - n_units * unit) > envelope.PRECISION:
+        err_str = '%r is not a multiple of unit %r' % (value, unit)
+        raise envelope.EnvelopeError(err_str)
+    return n_units
+
+
+def _ceil_div(numerator, denominator):
+    """
+    Integer division rounding towards positive infinity
+    """
+    return -(-numerator // denominator)
+
+
+class FixedGridEnvelope(object):
+    """
+    A FixedGridEnvelope is the integer counterpart of a RasterEnvelope.  All
+    coordinates and the cell size are integers counted in units.  As with
+    RasterEnvelope, the envelope is grown from the upper-left corner to be
+    a multiple of the cell size.
+    """
+
+    def __init__(self, x_min, y_min, x_max, y_max, cell_size, unit):
+        """
+        Initialize a FixedGridEnvelope instance
+
+        Parameters
+        ----------
+        x_min : int
+            Minimum x coordinate in units
+
+        y_min : int
+            Minimum y coordinate in units
+
+        x_max : int
+            Maximum x coordinate in units
+
+        y_max : int
+            Maximum y coordinate in units
+
+        cell_size : int
+            Cell size in units
+
+        unit : double
+            Size of one unit in coordinate space
+        """
+        if x_min >= x_max or y_min >= y_max:
+            err_str = 'Invalid envelope shape'
+            raise envelope.EnvelopeError(err_str)
+        if cell_size <= 0 or unit <= 0:
+            err_str = 'Cell size and unit must be positive'
+            raise envelope.EnvelopeError(err_str)
+
+        self._x_min = int(x_min)
+        self._y_max = int(y_max)
+        self._cell_size = int(cell_size)
+        self._unit = unit
+        self._x_size = _ceil_div(int(x_max) - self._x_min, self._cell_size)
+        self._y_size = _ceil_div(self._y_max - int(y_min), self._cell_size)
+
+    def __repr__(self):
+        """
+        Pretty print a FixedGridEnvelope instance
+        """
+        return '%s(%d, %d, %d, %d, %d, %r)' % (self.__class__.__name__,
+            self.x_min, self.y_min, self.x_max, self.y_max, self.cell_size,
+            self.unit)
+
+    def _get_key(self):
+        """
+        Tuple which uniquely identifies this envelope
+        """
+        return (self._x_min, self._y_max, self._cell_size, self._x_size,
+            self._y_size, self._unit)
+
+    def __eq__(self, other):
+        """
+        Exact equality operator
+        """
+        if not isinstance(other, FixedGridEnvelope):
+            return NotImplemented
+        return self._get_key() == other._get_key()
+
+    def __ne__(self, other):
+        """
+        Exact inequality operator
+        """
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        """
+        Hash consistent with equality
+        """
+        return hash(self._get_key())
+
+    @classmethod
+    def from_raster_envelope(cls, raster_env, unit):
+        """
+        Create a FixedGridEnvelope from a RasterEnvelope
+
+        Parameters
+        ----------
+        raster_env : RasterEnvelope
+            The envelope to convert.  Its upper-left corner and cell size
+            must be multiples of unit
+
+        unit : double
+            Size of one unit in coordinate space
+        """
+        x_min = to_units(raster_env.x_min, unit)
+        y_max = to_units(raster_env.y_max, unit)
+        cell_size = to_units(raster_env.cell_size, unit)
+        return cls(x_min, y_max - raster_env.y_size * cell_size,
+            x_min + raster_env.x_size * cell_size, y_max, cell_size, unit)
+
+    def to_raster_envelope(self):
+        """
+        Convert to a floating-point RasterEnvelope with the same number of
+        rows and columns
+        """
+        return envelope.RasterEnvelope.from_origin(self._x_min * self._unit,
+            self._y_max * self._unit, self._cell_size * self._unit,
+            self._x_size, self._y_size)
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def x_min(self):
+        return self._x_min
+
+    @property
+    def y_min(self):
+        return self._y_max - self._y_size * self._cell_size
+
+    @property
+    def x_max(self):
+        return self._x_min + self._x_size * self._cell_size
+
+    @property
+    def y_max(self):
+        return self._y_max
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    @property
+    def unit(self):
+        return self._unit
+
+    @property
+    def x_size(self):
+        return self._x_size
+
+    @property
+    def y_size(self):
+        return self._y_size
+    # pylint: enable=missing-docstring
+
+    def _assert_compatible(self, other):
+        """
+        Ensure that other uses the same unit and cell size
+        """
+        if self._unit != other.unit or self._cell_size != other.cell_size:
+            err_str = 'Envelopes have different units or cell sizes'
+            raise envelope.EnvelopeError(err_str)
+
+    def is_snapped(self, other):
+        """
+        Tests whether self and other are snapped (or aligned)
+        """
+        if self._unit != other.unit or self._cell_size != other.cell_size:
+            return False
+        if (self.x_min - other.x_min) % self._cell_size:
+            return False
+        if (self.y_max - other.y_max) % self._cell_size:
+            return False
+        return True
+
+    def is_subset(self, other):
+        """
+        Tests whether self is a subset of other (allowed to be coincident)
+        """
+        return (self.x_min >= other.x_min and self.x_max <= other.x_max and
+            self.y_min >= other.y_min and self.y_max <= other.y_max)
+
+    def is_superset(self, other):
+        """
+        Tests whether self is a superset of other (allowed to be coincident)
+        """
+        return other.is_subset(self)
+
+    def is_disjoint(self, other):
+        """
+        Tests whether self and other are disjoint (non-overlapping)
+        """
+        return (self.x_min > other.x_max or self.x_max < other.x_min or
+            self.y_min > other.y_max or self.y_max < other.y_min)
+
+    def snap(self, x_min, y_min, x_max, y_max):
+        """
+        Return the minimum FixedGridEnvelope snapped to self that bounds
+        the given integer coordinates
+
+        Parameters
+        ----------
+        x_min, y_min, x_max, y_max : int
+            Bounding coordinates in units
+
+        Returns
+        -------
+        min_env : FixedGridEnvelope
+            The minimum bounding envelope
+        """
+        cell_size = self._cell_size
+        x_off = (x_min - self._x_min) // cell_size
+        y_off = (self._y_max - y_max) // cell_size
+        x_end = _ceil_div(x_max - self._x_min, cell_size)
+        y_end = _ceil_div(self._y_max - y_min, cell_size)
+        return self.get_window(x_off, y_off, x_end - x_off, y_end - y_off)
+
+    def union(self, other):
+        """
+        Return the minimum envelope snapped to self that bounds both self
+        and other
+        """
+        self._assert_compatible(other)
+        return self.snap(min(self.x_min, other.x_min),
+            min(self.y_min, other.y_min), max(self.x_max, other.x_max),
+            max(self.y_max, other.y_max))
+
+    def intersection(self, other):
+        """
+        Return the minimum envelope snapped to self that bounds the overlap
+        of self and other.  Raises an exception if they do not overlap.
+        """
+        self._assert_compatible(other)
+        x_min = max(self.x_min, other.x_min)
+        y_min = max(self.y_min, other.y_min)
+        x_max = min(self.x_max, other.x_max)
+        y_max = min(self.y_max, other.y_max)
+        if x_min >= x_max or y_min >= y_max:
+            err_str = 'The two envelopes do not overlap'
+            raise envelope.EnvelopeError(err_str)
+        return self.snap(x_min, y_min, x_max, y_max)
+
+    def get_offset_from_xy(self, x, y):
+        """
+        Return the offset (ie. column and row) based on an integer x, y
+        coordinate in units
+
+        Returns
+        -------
+        (x_off, y_off) : tuple
+            The X (column) and Y (row) offsets into the envelope
+        """
+        return ((x - self._x_min) // self._cell_size,
+            (self._y_max - y) // self._cell_size)
+
+    def get_xy_from_offset(self, x_off, y_off):
+        """
+        Return a cell's upper-left integer x, y coordinate based on a
+        column/row offset
+        """
+        return (self._x_min + x_off * self._cell_size,
+            self._y_max - y_off * self._cell_size)
+
+    def get_window(self, x_off, y_off, x_size, y_size):
+        """
+        Return a FixedGridEnvelope snapped to self covering the window
+        starting at the given column/row offset
+        """
+        if x_size <= 0 or y_size <= 0:
+            err_str = 'Window dimensions must be positive'
+            raise envelope.EnvelopeError(err_str)
+        (x_min, y_max) = self.get_xy_from_offset(x_off, y_off)
+        return FixedGridEnvelope(x_min, y_max - y_size * self._cell_size,
+            x_min + x_size * self._cell_size, y_max, self._cell_size,
+            self._unit)
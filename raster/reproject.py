@@ -0,0 +1,276 @@
+"""
+Batch envelope reprojection.  Many Envelopes are reprojected together by
+densifying their edges, transforming every edge point in a single array
+call and taking the bounds of the transformed points.  Using only the
+corners undersizes extents whenever edges curve in the target coordinate
+system (e.g. between UTM zones or into Albers).
+"""
+
+import numpy as np
+from osgeo import osr
+
+from spatial_tools.raster import envelope
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+BACKENDS = ('osr', 'pyproj')
+
+
+class ReprojectError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_spatial_reference(srs):
+    """
+    Return an osr.SpatialReference using traditional GIS (x, y) axis order
+
+    Parameters
+    ----------
+    srs : osr.SpatialReference, int or str
+        An existing spatial reference, an EPSG code or any definition
+        understood by SetFromUserInput (WKT, PROJ string, 'EPSG:nnnn')
+
+    Returns
+    -------
+    sr : osr.SpatialReference
+        The spatial reference
+    """
+    if isinstance(srs, osr.SpatialReference):
+        sr = srs.Clone()
+    else:
+        sr = osr.SpatialReference()
+        if isinstance(srs, int):
+            err = sr.ImportFromEPSG(srs)
+        else:
+            err = sr.SetFromUserInput(srs)
+        if err:
+            err_str = 'Unable to interpret spatial reference %r' % (srs,)
+            raise ReprojectError(err_str)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return sr
+
+
+def densify_envelopes(envs, n_points=21):
+    """
+    Return points along the edges of each envelope
+
+    Parameters
+    ----------
+    envs : sequence
+        List or tuple of Envelopes
+
+    n_points : int
+        Number of points along each edge, including both corners
+
+    Returns
+    -------
+    (x, y) : tuple
+        Arrays of shape (len(envs), 4 * (n_points - 1)) holding the edge
+        points of each envelope, clockwise from the upper-left corner
+    """
+    if n_points < 2:
+        err_str = 'At least two points per edge are required'
+        raise ReprojectError(err_str)
+    coords = np.array([(e.x_min, e.y_min, e.x_max, e.y_max) for e in envs],
+        dtype=np.float64).reshape(-1, 4)
+    (x_min, y_min, x_max, y_max) = [c[:, np.newaxis] for c in coords.T]
+    width = x_max - x_min
+    height = y_max - y_min
+
+    # Each edge runs from its start corner up to, but excluding, the next
+    t = np.arange(n_points - 1, dtype=np.float64) / (n_points - 1)
+    ones = np.ones_like(t)
+    x = np.hstack([x_min + t * width, x_max * ones, x_max - t * width,
+        x_min * ones])
+    y = np.hstack([y_max * ones, y_max - t * height, y_min * ones,
+        y_min + t * height])
+    return (x, y)
+
+
+class EnvelopeTransformer(object):
+    """
+    An EnvelopeTransformer reprojects batches of Envelopes from one
+    coordinate system to another.  All points of a batch are transformed in
+    one call, with pyproj if it is installed and OSR otherwise.
+    """
+
+    def __init__(self, src_srs, dst_srs, backend=None):
+        """
+        Initialize an EnvelopeTransformer
+
+        Parameters
+        ----------
+        src_srs : osr.SpatialReference, int or str
+            Source coordinate system (see get_spatial_reference)
+
+        dst_srs : osr.SpatialReference, int or str
+            Target coordinate system
+
+        backend : str
+            Either 'osr' or 'pyproj'.  Defaults to pyproj when available
+        """
+        if backend is None:
+            backend = 'pyproj' if pyproj is not None else 'osr'
+        if backend not in BACKENDS:
+            err_str = 'Backend must be one of %s' % ', '.join(BACKENDS)
+            raise ReprojectError(err_str)
+        if backend == 'pyproj' and pyproj is None:
+            err_str = 'pyproj is not installed'
+            raise ReprojectError(err_str)
+
+        self._src_sr = get_spatial_reference(src_srs)
+        self._dst_sr = get_spatial_reference(dst_srs)
+        self._backend = backend
+        if backend == 'pyproj':
+            self._transform = pyproj.Transformer.from_crs(
+                self._src_sr.ExportToWkt(), self._dst_sr.ExportToWkt(),
+                always_xy=True)
+        else:
+            self._transform = osr.CoordinateTransformation(self._src_sr,
+                self._dst_sr)
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def src_sr(self):
+        return self._src_sr
+
+    @property
+    def dst_sr(self):
+        return self._dst_sr
+
+    @property
+    def backend(self):
+        return self._backend
+    # pylint: enable=missing-docstring
+
+    def transform_points(self, x, y):
+        """
+        Transform arrays of coordinates in a single call.  Points that
+        cannot be transformed are returned as NaN.
+
+        Parameters
+        ----------
+        x, y : numpy.ndarray
+            Coordinates in the source system.  Any matching shapes
+
+        Returns
+        -------
+        (x, y) : tuple
+            Arrays of the same shape in the target system
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.shape != y.shape:
+            err_str = 'x and y must have the same shape'
+            raise ReprojectError(err_str)
+        if not x.size:
+            return (x.copy(), y.copy())
+
+        if self._backend == 'pyproj':
+            (dst_x, dst_y) = self._transform.transform(x.ravel(), y.ravel(),
+                errcheck=False)
+            points = np.column_stack([dst_x, dst_y])
+        else:
+            points = np.array(self._transform.TransformPoints(
+                np.column_stack([x.ravel(), y.ravel()]).tolist()),
+                dtype=np.float64)[:, :2]
+        points[~np.isfinite(points).all(axis=1)] = np.nan
+        return (points[:, 0].reshape(x.shape), points[:, 1].reshape(x.shape))
+
+    def transform_envelopes(self, envs, n_points=21):
+        """
+        Reproject envelopes by densifying their edges and bounding the
+        transformed points
+
+        Parameters
+        ----------
+        envs : sequence
+            List or tuple of Envelopes in the source system
+
+        n_points : int
+            Number of points along each edge, including both corners
+
+        Returns
+        -------
+        dst_envs : list
+            Envelopes in the target system, in the same order as envs.
+            Entries are None where no edge point could be transformed
+        """
+        envs = list(envs)
+        if not envs:
+            return []
+        (x, y) = self.transform_points(*densify_envelopes(envs, n_points))
+        valid = np.isfinite(x).any(axis=1)
+        bounds = np.full((len(envs), 4), np.nan)
+        bounds[valid] = np.column_stack([np.nanmin(x[valid], axis=1),
+            np.nanmin(y[valid], axis=1), np.nanmax(x[valid], axis=1),
+            np.nanmax(y[valid], axis=1)])
+
+        dst_envs = []
+        for (is_valid, (x_min, y_min, x_max, y_max)) in zip(valid, bounds):
+            if not is_valid or x_min >= x_max or y_min >= y_max:
+                dst_envs.append(None)
+            else:
+                dst_envs.append(envelope.Envelope(float(x_min), float(y_min),
+                    float(x_max), float(y_max)))
+        return dst_envs
+
+    def transform_to_grid(self, envs, snap_re, n_points=21):
+        """
+        Reproject envelopes and snap each to a target grid with
+        get_minimum_bounding_envelope
+
+        Parameters
+        ----------
+        envs : sequence
+            List or tuple of Envelopes in the source system
+
+        snap_re : RasterEnvelope
+            Envelope in the target system providing the cell size and
+            snapping
+
+        n_points : int
+            Number of points along each edge, including both corners
+
+        Returns
+        -------
+        raster_envs : list
+            RasterEnvelopes in the target grid, in the same order as envs.
+            Entries are None where the envelope could not be transformed or
+            is disjoint from snap_re
+        """
+        raster_envs = []
+        for env in self.transform_envelopes(envs, n_points=n_points):
+            if env is None or env.is_disjoint(snap_re):
+                raster_envs.append(None)
+            else:
+                raster_envs.append(
+                    envelope.get_minimum_bounding_envelope(env, snap_re))
+        return raster_envs
+
+
+def reproject_envelopes(envs, src_srs, dst_srs, n_points=21, backend=None):
+    """
+    Convenience function to reproject a batch of envelopes.  See
+    EnvelopeTransformer.transform_envelopes
+    """
+    transformer = EnvelopeTransformer(src_srs, dst_srs, backend=backend)
+    return transformer.transform_envelopes(envs, n_points=n_points)
+
+
+def reproject_to_grid(envs, src_srs, dst_srs, snap_re, n_points=21,
+        backend=None):
+    """
+    Convenience function to reproject a batch of envelopes onto a target
+    grid.  See EnvelopeTransformer.transform_to_grid
+    """
+    transformer = EnvelopeTransformer(src_srs, dst_srs, backend=backend)
+    return transformer.transform_to_grid(envs, snap_re, n_points=n_points)
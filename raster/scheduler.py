@@ -0,0 +1,460 @@
+"""
+Resumable, sharded tile scheduling.  A RasterEnvelope tile grid is split
+into shards of spatially adjacent tiles which are handed out to workers
+through a SQLite-backed queue.  Workers lease shards, checkpoint finished
+tiles and complete or fail shards; expired leases are handed to other
+workers so a run survives the loss of a process or node.  Any number of
+processes, on one machine or several machines sharing a filesystem with
+working file locks, can use the same queue.
+"""
+
+import collections
+import json
+import os
+import socket
+import sqlite3
+import time
+
+from spatial_tools.raster import curves
+from spatial_tools.raster import envelope
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+Shard = collections.namedtuple('Shard', ['shard_id', 'tiles', 'done',
+    'attempts'])
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS shards (
+        shard_id INTEGER PRIMARY KEY,
+        tiles TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_expires REAL,
+        error TEXT
+    );
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        shard_id INTEGER NOT NULL,
+        tile_index INTEGER NOT NULL,
+        PRIMARY KEY (shard_id, tile_index)
+    );
+    CREATE INDEX IF NOT EXISTS shards_status ON shards (status);
+'''
+
+
+class SchedulerError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_worker_id():
+    """
+    Return an identifier for the current process that is unique across
+    machines
+    """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class TileScheduler(object):
+    """
+    A TileScheduler manages a persistent queue of tile shards in a SQLite
+    database.  The database is created by the first call to create() and
+    reopened by workers and by restarted runs.
+    """
+
+    def __init__(self, db_path, lease_seconds=600.0, max_attempts=3,
+            timeout=60.0):
+        """
+        Open (or create) a scheduler database
+
+        Parameters
+        ----------
+        db_path : str
+            File name of the SQLite database
+
+        lease_seconds : float
+            Time after which a leased shard that has not been checkpointed
+            or renewed may be handed to another worker
+
+        max_attempts : int
+            Number of times a shard is tried before it is marked failed
+
+        timeout : float
+            Seconds to wait for the database lock
+        """
+        self._db_path = db_path
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._conn = sqlite3.connect(db_path, timeout=timeout,
+            isolation_level=None)
+        self._conn.executescript(_SCHEMA)
+        self._raster_env = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def db_path(self):
+        return self._db_path
+
+    @property
+    def raster_env(self):
+        if self._raster_env is None:
+            self._raster_env = self._load_envelope()
+        return self._raster_env
+    # pylint: enable=missing-docstring
+
+    def close(self):
+        """
+        Close the underlying database connection
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _transaction(self):
+        """
+        Begin a write transaction.  BEGIN IMMEDIATE takes the write lock up
+        front so that concurrent workers cannot claim the same shard.
+        """
+        self._conn.execute('BEGIN IMMEDIATE')
+
+    def _load_envelope(self):
+        """
+        Rebuild the RasterEnvelope of the tile grid from the database
+        """
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'grid'").fetchone()
+        if row is None:
+            err_str = 'Scheduler has not been created'
+            raise SchedulerError(err_str)
+        grid = json.loads(row[0])
+        return envelope.RasterEnvelope.from_origin(grid['x_min'],
+            grid['y_max'], grid['cell_size'], grid['x_size'], grid['y_size'])
+
+    def create(self, raster_env, tile_x_size, tile_y_size=None,
+            shard_size=16, order='hilbert'):
+        """
+        Populate the queue with the tiles of raster_env.  If the queue
+        already exists for the same grid, this is a no-op so that restarted
+        runs resume where they left off.
+
+        Parameters
+        ----------
+        raster_env : RasterEnvelope
+            The full extent to process
+
+        tile_x_size : int
+            Number of columns in each tile
+
+        tile_y_size : int
+            Number of rows in each tile.  Defaults to tile_x_size
+
+        shard_size : int
+            Number of tiles per shard
+
+        order : str
+            Tile order used to build shards: 'hilbert', 'morton' or 'row'.
+            Curve orders keep each shard spatially compact
+
+        Returns
+        -------
+        created : bool
+            True if the queue was populated, False if it already existed
+        """
+        if tile_y_size is None:
+            tile_y_size = tile_x_size
+        if shard_size < 1:
+            err_str = 'Shard size must be positive'
+            raise SchedulerError(err_str)
+        grid = json.dumps({
+            'x_min': raster_env.x_min,
+            'y_max': raster_env.y_max,
+            'cell_size': raster_env.cell_size,
+            'x_size': raster_env.x_size,
+            'y_size': raster_env.y_size,
+            'tile_x_size': tile_x_size,
+            'tile_y_size': tile_y_size,
+            'shard_size': shard_size,
+            'order': order,
+        }, sort_keys=True)
+
+        tiles = envelope.get_tiles(raster_env, tile_x_size, tile_y_size)
+        if order in curves.CURVES:
+            tiles = curves.sort_by_curve(tiles, raster_env, curve=order)
+        elif order != 'row':
+            err_str = 'Unknown tile order %s' % order
+            raise SchedulerError(err_str)
+
+        self._transaction()
+        try:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'grid'").fetchone()
+            if row is not None:
+                self._conn.execute('COMMIT')
+                if row[0] != grid:
+                    err_str = 'Existing queue was created for another grid'
+                    raise SchedulerError(err_str)
+                return False
+
+            self._conn.execute("INSERT INTO meta VALUES ('grid', ?)", (grid,))
+            for shard_id, start in enumerate(range(0, len(tiles),
+                    shard_size)):
+                offsets = [envelope.get_grid_offset(raster_env, t) +
+                    (t.x_size, t.y_size)
+                    for t in tiles[start:start + shard_size]]
+                self._conn.execute('INSERT INTO shards (shard_id, tiles, '
+                    'status) VALUES (?, ?, ?)',
+                    (shard_id, json.dumps(offsets), PENDING))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            raise
+        self._raster_env = None
+        return True
+
+    def claim(self, worker_id=None):
+        """
+        Lease the next available shard.  Pending shards are handed out
+        first, then shards whose lease has expired.
+
+        Parameters
+        ----------
+        worker_id : str
+            Identifier of the claiming worker.  Defaults to get_worker_id()
+
+        Returns
+        -------
+        shard : Shard or None
+            The leased shard, or None if no shard is available
+        """
+        if worker_id is None:
+            worker_id = get_worker_id()
+        now = time.time()
+        self._transaction()
+        try:
+            # Expired leases that have used up their attempts are failed
+            self._conn.execute('UPDATE shards SET status = ?, '
+                "error = 'lease expired' WHERE status = ? AND "
+                'lease_expires < ? AND attempts >= ?',
+                (FAILED, LEASED, now, self._max_attempts))
+            row = self._conn.execute(
+                'SELECT shard_id, tiles, attempts FROM shards '
+                'WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY status = ? DESC, shard_id LIMIT 1',
+                (PENDING, LEASED, now, PENDING)).fetchone()
+            if row is None:
+                self._conn.execute('COMMIT')
+                return None
+            (shard_id, tiles, attempts) = row
+            self._conn.execute('UPDATE shards SET status = ?, worker = ?, '
+                'lease_expires = ?, attempts = ? WHERE shard_id = ?',
+                (LEASED, worker_id, now + self._lease_seconds, attempts + 1,
+                shard_id))
+            done = set(r[0] for r in self._conn.execute(
+                'SELECT tile_index FROM checkpoints WHERE shard_id = ?',
+                (shard_id,)))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            raise
+
+        raster_env = self.raster_env
+        tiles = [raster_env.get_window(*t) for t in json.loads(tiles)]
+        return Shard(shard_id, tiles, done, attempts + 1)
+
+    def _update_lease(self, shard_id, worker_id, sql, params):
+        """
+        Run sql within a transaction if worker_id still holds the lease on
+        shard_id.  Returns False if the lease has been lost.
+        """
+        self._transaction()
+        try:
+            row = self._conn.execute('SELECT status, worker FROM shards '
+                'WHERE shard_id = ?', (shard_id,)).fetchone()
+            if row is None or row[0] != LEASED or row[1] != worker_id:
+                self._conn.execute('COMMIT')
+                return False
+            for (statement, args) in zip(sql, params):
+                self._conn.execute(statement, args)
+            self._conn.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            raise
+        return True
+
+    def renew(self, shard_id, worker_id=None):
+        """
+        Extend the lease on a shard.  Returns False if the lease was lost.
+        """
+        if worker_id is None:
+            worker_id = get_worker_id()
+        return self._update_lease(shard_id, worker_id,
+            ['UPDATE shards SET lease_expires = ? WHERE shard_id = ?'],
+            [(time.time() + self._lease_seconds, shard_id)])
+
+    def checkpoint(self, shard_id, tile_index, worker_id=None):
+        """
+        Record that a tile of a shard is finished and extend the lease.
+        Returns False if the lease was lost.
+
+        Parameters
+        ----------
+        shard_id : int
+            The shard identifier
+
+        tile_index : int
+            Index of the finished tile within the shard
+
+        worker_id : str
+            Identifier of the worker holding the lease
+        """
+        if worker_id is None:
+            worker_id = get_worker_id()
+        return self._update_lease(shard_id, worker_id, [
+            'INSERT OR IGNORE INTO checkpoints VALUES (?, ?)',
+            'UPDATE shards SET lease_expires = ? WHERE shard_id = ?',
+        ], [
+            (shard_id, tile_index),
+            (time.time() + self._lease_seconds, shard_id),
+        ])
+
+    def complete(self, shard_id, worker_id=None):
+        """
+        Mark a shard as done.  Returns False if the lease was lost.
+        """
+        if worker_id is None:
+            worker_id = get_worker_id()
+        return self._update_lease(shard_id, worker_id,
+            ['UPDATE shards SET status = ?, lease_expires = NULL '
+            'WHERE shard_id = ?'], [(DONE, shard_id)])
+
+    def fail(self, shard_id, error='', worker_id=None):
+        """
+        Release a shard after an error.  It is returned to the queue unless
+        it has reached max_attempts, in which case it is marked failed.
+        Returns False if the lease was lost.
+        """
+        if worker_id is None:
+            worker_id = get_worker_id()
+        row = self._conn.execute('SELECT attempts FROM shards '
+            'WHERE shard_id = ?', (shard_id,)).fetchone()
+        status = FAILED if row and row[0] >= self._max_attempts else PENDING
+        return self._update_lease(shard_id, worker_id,
+            ['UPDATE shards SET status = ?, worker = NULL, '
+            'lease_expires = NULL, error = ? WHERE shard_id = ?'],
+            [(status, str(error), shard_id)])
+
+    def reset_failed(self):
+        """
+        Return failed shards to the queue with their attempts reset
+        """
+        self._conn.execute('UPDATE shards SET status = ?, attempts = 0 '
+            'WHERE status = ?', (PENDING, FAILED))
+
+    def get_progress(self):
+        """
+        Return the number of shards in each state and the number of
+        checkpointed tiles
+
+        Returns
+        -------
+        progress : dict
+            Counts keyed by status, plus 'tiles_done'
+        """
+        progress = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        for (status, count) in self._conn.execute(
+                'SELECT status, COUNT(*) FROM shards GROUP BY status'):
+            progress[status] = count
+        progress['tiles_done'] = self._conn.execute(
+            'SELECT COUNT(*) FROM checkpoints').fetchone()[0]
+        return progress
+
+    def is_finished(self):
+        """
+        Return True if no shards are pending or leased
+        """
+        progress = self.get_progress()
+        return progress[PENDING] == 0 and progress[LEASED] == 0
+
+
+def run_worker(db_path, func, worker_id=None, lease_seconds=600.0,
+        max_attempts=3, poll_seconds=5.0, wait=True):
+    """
+    Process shards from a scheduler until the queue is finished.  func is
+    called as func(tile_re) for every tile that has not been checkpointed.
+    Intended to be run in many processes (or on many machines) at once.
+
+    Parameters
+    ----------
+    db_path : str
+        File name of the scheduler database
+
+    func : callable
+        Function processing a single tile
+
+    worker_id : str
+        Identifier of this worker.  Defaults to get_worker_id()
+
+    lease_seconds : float
+        Lease duration; see TileScheduler
+
+    max_attempts : int
+        Attempts per shard; see TileScheduler
+
+    poll_seconds : float
+        Time to wait before polling again when all remaining shards are
+        leased by other workers
+
+    wait : bool
+        Whether to keep polling while other workers hold leases.  If
+        False, return as soon as no shard can be claimed
+
+    Returns
+    -------
+    n_tiles : int
+        Number of tiles processed by this worker
+    """
+    if worker_id is None:
+        worker_id = get_worker_id()
+    n_tiles = 0
+    with TileScheduler(db_path, lease_seconds=lease_seconds,
+            max_attempts=max_attempts) as scheduler:
+        while True:
+            shard = scheduler.claim(worker_id)
+            if shard is None:
+                if not wait or scheduler.is_finished():
+                    break
+                time.sleep(poll_seconds)
+                continue
+            try:
+                for (i, tile_re) in enumerate(shard.tiles):
+                    if i in shard.done:
+                        continue
+                    func(tile_re)
+                    n_tiles += 1
+                    if not scheduler.checkpoint(shard.shard_id, i,
+                            worker_id):
+                        break
+                else:
+                    scheduler.complete(shard.shard_id, worker_id)
+            except Exception as e:  # pylint: disable=broad-except
+                scheduler.fail(shard.shard_id, error=e, worker_id=worker_id)
+    return n_tiles
@@ -0,0 +1,360 @@
+"""
+Aligned multi-raster stacks.  A RasterStack presents the bands of several
+GDAL datasets as a single lazy 3-D array (layer x row x column) on a common
+grid.  Data are only read from disk when a window or chunk is requested.
+"""
+
+import math
+
+import numpy as np
+from osgeo import gdal_array
+
+from spatial_tools.raster import envelope
+
+
+class RasterStackError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_band_dtype(band):
+    """
+    Return the numpy dtype corresponding to a GDAL band's data type
+    """
+    return np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+
+
+def get_fill_dtype(value):
+    """
+    Return the smallest numpy dtype that can hold a fill value.  Integral
+    floats (as GDAL reports all nodata values) are treated as integers.
+    """
+    if isinstance(value, float) and value.is_integer() and \
+            abs(value) < 2 ** 63:
+        value = int(value)
+    return np.min_scalar_type(value)
+
+
+def read_window(band, band_env, window_env, fill_value=0, dtype=None,
+        out=None):
+    """
+    Read the cells of a GDAL band that fall within window_env.  Cells of the
+    window outside of the band's footprint are set to fill_value.
+
+    Parameters
+    ----------
+    band : gdal.Band
+        The band to read from
+
+    band_env : RasterEnvelope
+        The envelope of the band's dataset
+
+    window_env : RasterEnvelope
+        The envelope to read, aligned to band_env
+
+    fill_value : number
+        Value to assign to cells outside of band_env
+
+    dtype : numpy.dtype
+        Data type of the returned array.  Defaults to the band's type
+
+    out : numpy.ndarray
+        Optional (y_size, x_size) array to read into
+
+    Returns
+    -------
+    arr : numpy.ndarray
+        Array of shape (window_env.y_size, window_env.x_size)
+    """
+    if out is None:
+        if dtype is None:
+            dtype = get_band_dtype(band)
+        out = np.empty((window_env.y_size, window_env.x_size), dtype=dtype)
+
+    # Clip the window to the band's footprint in band cell space
+    (x_off, y_off) = envelope.get_grid_offset(band_env, window_env)
+    x_start = max(x_off, 0)
+    y_start = max(y_off, 0)
+    x_end = min(x_off + window_env.x_size, band_env.x_size)
+    y_end = min(y_off + window_env.y_size, band_env.y_size)
+
+    if x_start >= x_end or y_start >= y_end:
+        out[:] = fill_value
+        return out
+
+    if x_end - x_start != window_env.x_size or \
+            y_end - y_start != window_env.y_size:
+        out[:] = fill_value
+    arr = band.ReadAsArray(x_start, y_start, x_end - x_start,
+        y_end - y_start)
+    out[y_start - y_off:y_end - y_off, x_start - x_off:x_end - x_off] = arr
+    return out
+
+
+class RasterStack(object):
+    """
+    A RasterStack aligns every band of a list of GDAL datasets onto a common
+    RasterEnvelope and exposes them as a lazy array of shape
+    (n_layers, y_size, x_size).  Windows are read on demand, either by
+    indexing with an Envelope or by iterating over chunks.
+    """
+
+    def __init__(self, datasets, method='min', snap_re=None,
+            chunk_size=(256, 256), nodata=None, dtype=None):
+        """
+        Initialize a RasterStack from a list of GDAL datasets.  All datasets
+        must share the same cell size and grid alignment.
+
+        Parameters
+        ----------
+        datasets : sequence
+            List or tuple of gdal.Dataset instances
+
+        method : str
+            Either 'min' (intersection of all datasets, see min_of) or
+            'max' (union of all datasets, see max_of)
+
+        snap_re : RasterEnvelope
+            The RasterEnvelope to use for the snapping environment.
+            Defaults to the envelope of the first dataset
+
+        chunk_size : tuple
+            (y_size, x_size) of chunks used for iteration
+
+        nodata : number
+            Value used for cells outside a dataset's footprint.  If None,
+            each band's own nodata value is used, falling back to 0
+
+        dtype : numpy.dtype
+            Data type of arrays returned from the stack.  Defaults to the
+            common type of all bands
+        """
+        if not datasets:
+            err_str = 'At least one dataset is required'
+            raise RasterStackError(err_str)
+
+        self._datasets = list(datasets)
+        self._envelopes = [envelope.RasterEnvelope.from_gdal_dataset(ds)
+            for ds in self._datasets]
+
+        if method == 'min':
+            self._envelope = envelope.min_of(self._envelopes, snap_re=snap_re)
+        elif method == 'max':
+            self._envelope = envelope.max_of(self._envelopes, snap_re=snap_re)
+        else:
+            err_str = 'Method must be one of "min" or "max"'
+            raise RasterStackError(err_str)
+
+        # Ensure every dataset is on the stack grid
+        for env in self._envelopes:
+            if math.fabs(env.cell_size - self._envelope.cell_size) > \
+                    envelope.PRECISION:
+                err_str = 'All datasets must share the same cell size'
+                raise RasterStackError(err_str)
+            envelope.get_grid_offset(self._envelope, env)
+
+        # Layers are the bands of each dataset, in order
+        self._layers = []
+        self._fill_values = []
+        dtypes = []
+        for i, ds in enumerate(self._datasets):
+            for band_num in range(1, ds.RasterCount + 1):
+                band = ds.GetRasterBand(band_num)
+                self._layers.append((i, band_num))
+                dtypes.append(get_band_dtype(band))
+                if nodata is None:
+                    band_nodata = band.GetNoDataValue()
+                    if band_nodata is None:
+                        band_nodata = 0
+                else:
+                    band_nodata = nodata
+                self._fill_values.append(band_nodata)
+
+        # The stack type must also hold every fill value
+        fill_dtypes = [get_fill_dtype(v) for v in self._fill_values]
+        if dtype is None:
+            self._dtype = np.result_type(*(dtypes + fill_dtypes))
+        else:
+            self._dtype = np.dtype(dtype)
+            for (value, fill_dtype) in zip(self._fill_values, fill_dtypes):
+                if not np.can_cast(fill_dtype, self._dtype):
+                    err_str = 'Fill value %r cannot be represented as %s' % (
+                        value, self._dtype)
+                    raise RasterStackError(err_str)
+        self._chunk_size = tuple(chunk_size)
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def envelope(self):
+        return self._envelope
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def fill_values(self):
+        return list(self._fill_values)
+
+    @property
+    def n_layers(self):
+        return len(self._layers)
+
+    @property
+    def shape(self):
+        return (self.n_layers, self._envelope.y_size, self._envelope.x_size)
+    # pylint: enable=missing-docstring
+
+    def __len__(self):
+        """
+        Number of layers in the stack
+        """
+        return self.n_layers
+
+    def __getitem__(self, key):
+        """
+        Read all layers covering an Envelope.  Alternatively, key may be a
+        (layers, Envelope) tuple where layers is an int, slice or sequence
+        of layer indexes.
+        """
+        if isinstance(key, tuple):
+            (layers, env) = key
+        else:
+            (layers, env) = (None, key)
+        return self.read(env, layers=layers)
+
+    def __iter__(self):
+        """
+        Iterate over (chunk_envelope, array) pairs for all layers
+        """
+        return self.iter_chunks()
+
+    def _get_layer_indexes(self, layers):
+        """
+        Normalize a layer selection to a list of layer indexes
+        """
+        if layers is None:
+            return list(range(self.n_layers))
+        if isinstance(layers, slice):
+            return list(range(self.n_layers))[layers]
+        if isinstance(layers, (int, np.integer)):
+            return [list(range(self.n_layers))[layers]]
+        return [list(range(self.n_layers))[i] for i in layers]
+
+    def get_window(self, env):
+        """
+        Return the RasterEnvelope on the stack grid that minimally covers
+        the part of env that falls within the stack
+
+        Parameters
+        ----------
+        env : Envelope
+            The area of interest
+
+        Returns
+        -------
+        window_re : RasterEnvelope
+            Window snapped to and contained within the stack envelope
+        """
+        overlap = envelope.Envelope.intersection(self._envelope, env)
+        window_re = \
+            envelope.get_minimum_bounding_envelope(overlap, self._envelope)
+
+        # Rebuild from integer offsets to clip any floating-point overhang
+        (x_off, y_off) = envelope.get_grid_offset(self._envelope, window_re)
+        x_size = min(window_re.x_size, self._envelope.x_size - x_off)
+        y_size = min(window_re.y_size, self._envelope.y_size - y_off)
+        return self._envelope.get_window(x_off, y_off, x_size, y_size)
+
+    def read(self, env, layers=None, out=None):
+        """
+        Read a window from the stack
+
+        Parameters
+        ----------
+        env : Envelope
+            The area to read.  It is snapped to, and clipped by, the stack
+            envelope
+
+        layers : int, slice or sequence
+            Layers to read.  Defaults to all layers
+
+        out : numpy.ndarray
+            Optional array of shape (n_layers, y_size, x_size) to read into
+
+        Returns
+        -------
+        arr : numpy.ndarray
+            Array of shape (n_layers, y_size, x_size)
+        """
+        window_re = self.get_window(env)
+        return self.read_window(window_re, layers=layers, out=out)
+
+    def read_window(self, window_re, layers=None, out=None):
+        """
+        Read a window that is already aligned to the stack grid.  Unlike
+        read, the window is not clipped to the stack envelope; cells outside
+        of a dataset's footprint are filled with that layer's nodata value.
+
+        Parameters
+        ----------
+        window_re : RasterEnvelope
+            The window to read
+
+        layers : int, slice or sequence
+            Layers to read.  Defaults to all layers
+
+        out : numpy.ndarray
+            Optional array of shape (n_layers, y_size, x_size) to read into
+
+        Returns
+        -------
+        arr : numpy.ndarray
+            Array of shape (n_layers, y_size, x_size)
+        """
+        indexes = self._get_layer_indexes(layers)
+        shape = (len(indexes), window_re.y_size, window_re.x_size)
+        if out is None:
+            out = np.empty(shape, dtype=self._dtype)
+        elif out.shape != shape:
+            err_str = 'Output array shape %s does not match %s' % (
+                out.shape, shape)
+            raise RasterStackError(err_str)
+
+        for i, layer_index in enumerate(indexes):
+            (ds_index, band_num) = self._layers[layer_index]
+            band = self._datasets[ds_index].GetRasterBand(band_num)
+            read_window(band, self._envelopes[ds_index], window_re,
+                fill_value=self._fill_values[layer_index], out=out[i])
+        return out
+
+    def get_chunks(self):
+        """
+        Return the row-major list of chunk envelopes covering the stack
+        """
+        (y_size, x_size) = self._chunk_size
+        return envelope.get_tiles(self._envelope, x_size, y_size)
+
+    def iter_chunks(self, layers=None):
+        """
+        Lazily read the stack one chunk at a time
+
+        Parameters
+        ----------
+        layers : int, slice or sequence
+            Layers to read.  Defaults to all layers
+
+        Returns
+        -------
+        chunks : generator
+            Generator of (chunk_envelope, array) tuples
+        """
+        for chunk_re in self.get_chunks():
+            yield (chunk_re, self.read_window(chunk_re, layers=layers))
@@ -0,0 +1,571 @@
+"""
+Mergeable streaming statistics for rasters.  Summaries are updated one tile
+at a time, never holding the full raster in memory, and summaries computed
+by different workers can be merged into one.  All summaries ignore nodata
+and NaN cells.
+"""
+
+import concurrent.futures
+import math
+
+import numpy as np
+
+from spatial_tools.raster import envelope
+
+
+class StatisticsError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_valid_values(arr, nodata=None):
+    """
+    Return a flat float64 array of the values of arr that are not nodata
+    or NaN
+
+    Parameters
+    ----------
+    arr : numpy.ndarray
+        Input values
+
+    nodata : number
+        Value to exclude
+
+    Returns
+    -------
+    values : numpy.ndarray
+        1-D array of valid values
+    """
+    values = np.asarray(arr, dtype=np.float64).ravel()
+    mask = ~np.isnan(values)
+    if nodata is not None:
+        mask &= values != nodata
+    return values[mask]
+
+
+class RunningMoments(object):
+    """
+    Count, minimum, maximum, mean and variance accumulated with the
+    parallel form of Welford's algorithm
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = np.inf
+        self._max = -np.inf
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._mean if self._count else np.nan
+
+    @property
+    def min(self):
+        return self._min if self._count else np.nan
+
+    @property
+    def max(self):
+        return self._max if self._count else np.nan
+
+    @property
+    def variance(self):
+        return self._m2 / self._count if self._count else np.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self._count else np.nan
+    # pylint: enable=missing-docstring
+
+    def _combine(self, count, mean, m2, min_value, max_value):
+        """
+        Combine another set of moments into self
+        """
+        if count == 0:
+            return
+        total = self._count + count
+        delta = mean - self._mean
+        self._mean += delta * count / total
+        self._m2 += m2 + delta * delta * self._count * count / total
+        self._count = total
+        self._min = min(self._min, min_value)
+        self._max = max(self._max, max_value)
+
+    def update(self, arr, nodata=None):
+        """
+        Add the valid values of arr
+        """
+        values = get_valid_values(arr, nodata)
+        if values.size == 0:
+            return
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        self._combine(values.size, mean, m2, values.min(), values.max())
+
+    def merge(self, other):
+        """
+        Merge another RunningMoments into self
+        """
+        self._combine(other._count, other._mean, other._m2, other._min,
+            other._max)
+
+
+class FixedHistogram(object):
+    """
+    A histogram with fixed bin edges.  Values below the first edge or above
+    the last are counted separately.  Histograms with identical edges can
+    be merged by adding counts.
+    """
+
+    def __init__(self, range_min, range_max, n_bins=256):
+        """
+        Initialize a FixedHistogram with equal-width bins
+
+        Parameters
+        ----------
+        range_min : double
+            Lower edge of the first bin
+
+        range_max : double
+            Upper edge of the last bin
+
+        n_bins : int
+            Number of bins
+        """
+        if range_min >= range_max or n_bins < 1:
+            err_str = 'Invalid histogram range or number of bins'
+            raise StatisticsError(err_str)
+        self._edges = np.linspace(range_min, range_max, n_bins + 1)
+        self._counts = np.zeros(n_bins, dtype=np.int64)
+        self._under = 0
+        self._over = 0
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def edges(self):
+        return self._edges
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def under(self):
+        return self._under
+
+    @property
+    def over(self):
+        return self._over
+
+    @property
+    def count(self):
+        return int(self._counts.sum()) + self._under + self._over
+    # pylint: enable=missing-docstring
+
+    def update(self, arr, nodata=None):
+        """
+        Add the valid values of arr
+        """
+        values = get_valid_values(arr, nodata)
+        self._under += int(np.count_nonzero(values < self._edges[0]))
+        self._over += int(np.count_nonzero(values > self._edges[-1]))
+        counts = np.histogram(values, bins=self._edges)[0]
+        self._counts += counts
+
+    def merge(self, other):
+        """
+        Merge another FixedHistogram with the same edges into self
+        """
+        if not np.array_equal(self._edges, other.edges):
+            err_str = 'Histograms have different bin edges'
+            raise StatisticsError(err_str)
+        self._counts += other.counts
+        self._under += other.under
+        self._over += other.over
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) by linear interpolation within bins.  Values
+        outside the histogram range are clamped to its edges.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        cum = np.concatenate(([self._under],
+            self._under + np.cumsum(self._counts)))
+        total = self.count
+        if total == 0:
+            return np.full(q.shape, np.nan)
+        return np.interp(q * total, cum, self._edges)
+
+
+def _shrink_centroids(means, weights, max_bins):
+    """
+    Repeatedly merge the two closest centroids until at most max_bins
+    remain.  means must be sorted.
+    """
+    means = list(means)
+    weights = list(weights)
+    while len(means) > max_bins:
+        gaps = np.diff(means)
+        i = int(np.argmin(gaps))
+        weight = weights[i] + weights[i + 1]
+        means[i] = (means[i] * weights[i] + means[i + 1] * weights[i + 1]) / \
+            weight
+        weights[i] = weight
+        del means[i + 1]
+        del weights[i + 1]
+    return (np.array(means, dtype=np.float64),
+        np.array(weights, dtype=np.float64))
+
+
+def _centroid_quantile(means, weights, min_value, max_value, q):
+    """
+    Interpolate quantile(s) from sorted centroids, treating each centroid
+    as centered on its share of the cumulative weight
+    """
+    q = np.asarray(q, dtype=np.float64)
+    total = weights.sum()
+    if total == 0:
+        return np.full(q.shape, np.nan)
+    positions = (np.cumsum(weights) - weights / 2.0) / total
+    positions = np.concatenate(([0.0], positions, [1.0]))
+    values = np.concatenate(([min_value], means, [max_value]))
+    return np.interp(q, positions, values)
+
+
+class AdaptiveHistogram(object):
+    """
+    A streaming histogram with at most max_bins variable-width bins
+    (Ben-Haim and Tom-Tov).  Each bin is a centroid and a count; bins adapt
+    to the data so no range needs to be known in advance.  Each tile is
+    first reduced to max_bins equal-count bins so updates stay vectorized.
+    """
+
+    def __init__(self, max_bins=256):
+        """
+        Initialize an empty AdaptiveHistogram
+
+        Parameters
+        ----------
+        max_bins : int
+            Maximum number of bins
+        """
+        if max_bins < 2:
+            err_str = 'max_bins must be at least 2'
+            raise StatisticsError(err_str)
+        self._max_bins = max_bins
+        self._means = np.zeros(0)
+        self._weights = np.zeros(0)
+        self._min = np.inf
+        self._max = -np.inf
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def means(self):
+        return self._means
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def count(self):
+        return int(self._weights.sum())
+    # pylint: enable=missing-docstring
+
+    def _add_centroids(self, means, weights, min_value, max_value):
+        """
+        Add sorted centroids and shrink back to max_bins
+        """
+        all_means = np.concatenate((self._means, means))
+        all_weights = np.concatenate((self._weights, weights))
+        order = np.argsort(all_means, kind='mergesort')
+        (self._means, self._weights) = _shrink_centroids(all_means[order],
+            all_weights[order], self._max_bins)
+        self._min = min(self._min, min_value)
+        self._max = max(self._max, max_value)
+
+    def update(self, arr, nodata=None):
+        """
+        Add the valid values of arr
+        """
+        values = np.sort(get_valid_values(arr, nodata))
+        if values.size == 0:
+            return
+        n_groups = min(self._max_bins, values.size)
+        starts = (np.arange(n_groups) * values.size) // n_groups
+        weights = np.diff(np.append(starts, values.size)).astype(np.float64)
+        means = np.add.reduceat(values, starts) / weights
+        self._add_centroids(means, weights, values[0], values[-1])
+
+    def merge(self, other):
+        """
+        Merge another AdaptiveHistogram into self
+        """
+        if other.count:
+            self._add_centroids(other.means, other.weights, other._min,
+                other._max)
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) by interpolating between bin centroids
+        """
+        return _centroid_quantile(self._means, self._weights, self._min,
+            self._max, q)
+
+
+class TDigest(object):
+    """
+    A merging t-digest for approximate quantiles.  Centroids are small near
+    the tails and large near the median, as limited by the arcsine scale
+    function with compression delta, giving accurate extreme quantiles.
+    Compression is vectorized: sorted values are grouped by the integer
+    part of their scale-function position.
+    """
+
+    def __init__(self, delta=200):
+        """
+        Initialize an empty TDigest
+
+        Parameters
+        ----------
+        delta : int
+            Compression parameter; the digest keeps roughly delta centroids
+        """
+        if delta < 10:
+            err_str = 'delta must be at least 10'
+            raise StatisticsError(err_str)
+        self._delta = delta
+        self._means = np.zeros(0)
+        self._weights = np.zeros(0)
+        self._min = np.inf
+        self._max = -np.inf
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def means(self):
+        return self._means
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def count(self):
+        return int(self._weights.sum())
+    # pylint: enable=missing-docstring
+
+    def _compress(self, means, weights):
+        """
+        Merge sorted centroids so that each spans at most one unit of the
+        scale function
+        """
+        total = weights.sum()
+        left_q = (np.cumsum(weights) - weights) / total
+        k = self._delta / (2.0 * math.pi) * np.arcsin(2.0 * left_q - 1.0)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.diff(groups, prepend=-1))
+        new_weights = np.add.reduceat(weights, starts)
+        new_means = np.add.reduceat(means * weights, starts) / new_weights
+        return (new_means, new_weights)
+
+    def _add_centroids(self, means, weights, min_value, max_value):
+        """
+        Add centroids and recompress
+        """
+        all_means = np.concatenate((self._means, means))
+        all_weights = np.concatenate((self._weights, weights))
+        order = np.argsort(all_means, kind='mergesort')
+        (self._means, self._weights) = self._compress(all_means[order],
+            all_weights[order])
+        self._min = min(self._min, min_value)
+        self._max = max(self._max, max_value)
+
+    def update(self, arr, nodata=None):
+        """
+        Add the valid values of arr
+        """
+        values = get_valid_values(arr, nodata)
+        if values.size == 0:
+            return
+        self._add_centroids(values, np.ones(values.size), values.min(),
+            values.max())
+
+    def merge(self, other):
+        """
+        Merge another TDigest into self
+        """
+        if other.count:
+            self._add_centroids(other.means, other.weights, other._min,
+                other._max)
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) by interpolating between centroids
+        """
+        return _centroid_quantile(self._means, self._weights, self._min,
+            self._max, q)
+
+
+class RasterSummary(object):
+    """
+    A RasterSummary bundles running moments, an adaptive histogram, a
+    t-digest and, if a range is given, a fixed histogram, so that a single
+    pass over the tiles produces all of them
+    """
+
+    def __init__(self, nodata=None, hist_range=None, n_bins=256,
+            max_bins=256, delta=200):
+        """
+        Initialize an empty RasterSummary
+
+        Parameters
+        ----------
+        nodata : number
+            Value to exclude
+
+        hist_range : tuple
+            (min, max) of the fixed histogram, or None to skip it
+
+        n_bins : int
+            Number of fixed histogram bins
+
+        max_bins : int
+            Maximum number of adaptive histogram bins
+
+        delta : int
+            t-digest compression
+        """
+        self._nodata = nodata
+        self._moments = RunningMoments()
+        self._adaptive_histogram = AdaptiveHistogram(max_bins=max_bins)
+        self._digest = TDigest(delta=delta)
+        if hist_range is not None:
+            self._histogram = FixedHistogram(hist_range[0], hist_range[1],
+                n_bins=n_bins)
+        else:
+            self._histogram = None
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def moments(self):
+        return self._moments
+
+    @property
+    def adaptive_histogram(self):
+        return self._adaptive_histogram
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def histogram(self):
+        return self._histogram
+    # pylint: enable=missing-docstring
+
+    def update(self, arr):
+        """
+        Add the valid values of a tile
+        """
+        values = get_valid_values(arr, self._nodata)
+        self._moments.update(values)
+        self._adaptive_histogram.update(values)
+        self._digest.update(values)
+        if self._histogram is not None:
+            self._histogram.update(values)
+
+    def merge(self, other):
+        """
+        Merge another RasterSummary into self
+        """
+        if (self._histogram is None) != (other.histogram is None):
+            err_str = 'Only one of the summaries has a fixed histogram'
+            raise StatisticsError(err_str)
+        if self._histogram is not None and \
+                not np.array_equal(self._histogram.edges,
+                    other.histogram.edges):
+            err_str = 'Histograms have different bin edges'
+            raise StatisticsError(err_str)
+        self._moments.merge(other.moments)
+        self._adaptive_histogram.merge(other.adaptive_histogram)
+        self._digest.merge(other.digest)
+        if self._histogram is not None:
+            self._histogram.merge(other.histogram)
+
+    def quantile(self, q):
+        """
+        Estimate quantile(s) with the t-digest
+        """
+        return self._digest.quantile(q)
+
+
+def _summarize_tiles(read_tile, tiles, summary_kwargs):
+    """
+    Summarize a group of tiles in a worker
+    """
+    summary = RasterSummary(**summary_kwargs)
+    for tile_re in tiles:
+        summary.update(read_tile(tile_re))
+    return summary
+
+
+def summarize(raster_env, read_tile, tile_size=512, n_workers=1,
+        use_processes=False, **summary_kwargs):
+    """
+    Compute a RasterSummary over raster_env one tile at a time.  Tiles are
+    split into n_workers groups, each summarized independently, and the
+    partial summaries are merged.
+
+    Parameters
+    ----------
+    raster_env : RasterEnvelope
+        The extent to summarize
+
+    read_tile : callable
+        Function returning the array for a tile envelope.  It must be
+        picklable if use_processes is True
+
+    tile_size : int
+        Width and height of tiles
+
+    n_workers : int
+        Number of concurrent workers
+
+    use_processes : bool
+        Use a process pool instead of a thread pool
+
+    summary_kwargs : dict
+        Keyword arguments passed to RasterSummary
+
+    Returns
+    -------
+    summary : RasterSummary
+        The merged summary
+    """
+    tiles = envelope.get_tiles(raster_env, tile_size)
+    if n_workers <= 1:
+        return _summarize_tiles(read_tile, tiles, summary_kwargs)
+
+    if use_processes:
+        executor_cls = concurrent.futures.ProcessPoolExecutor
+    else:
+        executor_cls = concurrent.futures.ThreadPoolExecutor
+    summary = RasterSummary(**summary_kwargs)
+    with executor_cls(max_workers=n_workers) as executor:
+        futures = [executor.submit(_summarize_tiles, read_tile,
+            tiles[i::n_workers], summary_kwargs) for i in range(n_workers)]
+        for future in futures:
+            summary.merge(future.result())
+    return summary
@@ -0,0 +1,295 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for map algebra expressions
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from spatial_tools.raster import algebra
+from spatial_tools.raster import envelope
+
+
+def create_dataset(arr, x_min, y_max, cell_size, nodata=None,
+        gdal_type=gdal.GDT_Float32):
+    """
+    Create an in-memory single-band GDAL dataset from a 2-D array
+    """
+    (y_size, x_size) = arr.shape
+    driver = gdal.GetDriverByName('MEM')
+    ds = driver.Create('', x_size, y_size, 1, gdal_type)
+    ds.SetGeoTransform([x_min, cell_size, 0.0, y_max, 0.0, -cell_size])
+    band = ds.GetRasterBand(1)
+    band.WriteArray(arr)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    return ds
+
+
+class ExpressionTest(unittest.TestCase):
+    """
+    Expression class tests
+    """
+    def setUp(self):
+        """
+        Create two small input arrays
+        """
+        self.b3 = np.array([[1.0, 2.0, 3.0], [4.0, 0.0, 6.0]])
+        self.b4 = np.array([[3.0, 2.0, 1.0], [8.0, 0.0, 2.0]])
+        self.inputs = {'b3': self.b3, 'b4': self.b4}
+
+    def test_arithmetic(self):
+        """
+        Test arithmetic against plain numpy
+        """
+        expr = algebra.Expression('(b4 - b3) / (b4 + b3)', dtype=np.float64)
+        self.assertEqual(expr.names, ['b3', 'b4'])
+        with np.errstate(all='ignore'):
+            check = (self.b4 - self.b3) / (self.b4 + self.b3)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        expr = algebra.Expression('-b3 ** 2 + 2 * 3 - b4 % 2',
+            dtype=np.float64)
+        check = -self.b3 ** 2 + 6 - self.b4 % 2
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        expr = algebra.Expression('sqrt(abs(b3 - b4)) + maximum(b3, 2)',
+            dtype=np.float64)
+        check = np.sqrt(np.abs(self.b3 - self.b4)) + np.maximum(self.b3, 2)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+    def test_integer_inputs(self):
+        """
+        Test that integer inputs are computed in the expression type
+        """
+        b3 = np.array([[3000, 100]], dtype=np.uint16)
+        b4 = np.array([[1000, 200]], dtype=np.uint16)
+        expr = algebra.Expression('(b4 - b3) / (b4 + b3)')
+        np.testing.assert_allclose(expr.evaluate({'b3': b3, 'b4': b4}),
+            [[-0.5, 1.0 / 3.0]], rtol=1e-6)
+
+        expr = algebra.Expression('b4 + b3 - -b3')
+        result = expr.evaluate({'b3': b3.astype(np.uint8),
+            'b4': np.array([[100, 200]], dtype=np.uint8)})
+        np.testing.assert_array_equal(result, [[100.0 + 2 * 184, 400.0]])
+
+    def test_registers(self):
+        """
+        Test that registers are reused and buffers persist between calls
+        """
+        expr = algebra.Expression('(b4 - b3) / (b4 + b3)')
+        self.assertEqual(expr.n_registers, 2)
+        expr = algebra.Expression('((b3 + 1) * 2 - 3) / 4')
+        self.assertEqual(expr.n_registers, 1)
+
+        first = expr.evaluate(self.inputs)
+        second = expr.evaluate(self.inputs)
+        self.assert_(first is second)
+
+        out = np.empty(self.b3.shape, dtype=np.float32)
+        result = expr.evaluate(self.inputs, out=out)
+        self.assert_(result is out)
+        np.testing.assert_allclose(out, ((self.b3 + 1) * 2 - 3) / 4)
+
+        # Different output types are cast
+        out = np.empty(self.b3.shape, dtype=np.int16)
+        expr.evaluate(self.inputs, out=out)
+        np.testing.assert_array_equal(out,
+            (((self.b3 + 1) * 2 - 3) / 4).astype(np.int16))
+
+    def test_conditionals(self):
+        """
+        Test comparisons, logic and conditionals
+        """
+        expr = algebra.Expression('b3 > b4', dtype=np.float64)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs),
+            (self.b3 > self.b4).astype(float))
+
+        expr = algebra.Expression('b3 if b3 > b4 else b4 * 10',
+            dtype=np.float64)
+        check = np.where(self.b3 > self.b4, self.b3, self.b4 * 10)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        expr = algebra.Expression('where(b3 >= 2 and not b4 == 2, b3 + b4, 0)',
+            dtype=np.float64)
+        check = np.where((self.b3 >= 2) & (self.b4 != 2), self.b3 + self.b4,
+            0)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        expr = algebra.Expression('1 < b3 <= 4 or b4 == 0', dtype=np.float64)
+        check = ((1 < self.b3) & (self.b3 <= 4)) | (self.b4 == 0)
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+    def test_reclass(self):
+        """
+        Test lookup-table and range reclassification
+        """
+        expr = algebra.Expression('reclass(b3, {1: 10, 3: 30, 6: 60}, -1)',
+            dtype=np.float64)
+        check = np.array([[10.0, -1.0, 30.0], [-1.0, -1.0, 60.0]])
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        expr = algebra.Expression(
+            'reclass(b3 + b4, [(0, 4, 1), (4, 8, 2)], 3)', dtype=np.float64)
+        check = np.array([[2.0, 2.0, 2.0], [3.0, 1.0, 3.0]])
+        np.testing.assert_array_equal(expr.evaluate(self.inputs), check)
+
+        self.assertRaises(algebra.ExpressionError, algebra.Expression,
+            'reclass(b3, [(0, 4, 1), (2, 8, 2)])')
+        self.assertRaises(algebra.ExpressionError, algebra.Expression,
+            'reclass(b3, b4)')
+
+    def test_nodata(self):
+        """
+        Test masking of nodata inputs and non-finite results
+        """
+        expr = algebra.Expression('b4 / b3', nodata=-9999.0)
+        result = expr.evaluate(self.inputs, input_nodata={'b4': 1.0})
+        check = np.array([[3.0, 1.0, -9999.0], [2.0, -9999.0, 1.0 / 3.0]])
+        np.testing.assert_allclose(result, check)
+
+    def test_errors(self):
+        """
+        Test rejection of unsupported syntax and missing inputs
+        """
+        for bad in ('b3 +', '__import__("os")', 'b3.real', 'b3[0]',
+                'lambda: 1', 'sqrt(b3, b4=1)', '"a"'):
+            self.assertRaises(algebra.ExpressionError, algebra.Expression,
+                bad)
+        expr = algebra.Expression('b3 + b5')
+        self.assertRaises(algebra.ExpressionError, expr.evaluate,
+            self.inputs)
+
+
+class EvaluateTest(unittest.TestCase):
+    """
+    Raster evaluation tests
+    """
+    def setUp(self):
+        """
+        Create two overlapping datasets on the same grid
+        """
+        self.arr_3 = np.arange(100, dtype=np.float32).reshape(10, 10)
+        self.arr_4 = np.full((6, 6), 50.0, dtype=np.float32)
+        self.arr_4[2, 0] = -1.0
+        self.ds_3 = create_dataset(self.arr_3, 0.0, 10.0, 1.0)
+        self.ds_4 = create_dataset(self.arr_4, 6.0, 12.0, 1.0, nodata=-1.0)
+        self.datasets = {'b3': self.ds_3, 'b4': self.ds_4}
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Remove the temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_iter_evaluate(self):
+        """
+        Test chunked evaluation over the intersection of the rasters
+        """
+        chunks = list((chunk_re, arr.copy()) for (chunk_re, arr) in
+            algebra.iter_evaluate('b4 - b3', self.datasets,
+                chunk_size=(3, 3), nodata=-9999.0))
+        self.assertEqual(len(chunks), 4)
+        full_re = envelope.RasterEnvelope(6.0, 6.0, 10.0, 10.0, 1.0)
+        full = np.zeros((4, 4), dtype=np.float32)
+        for (chunk_re, arr) in chunks:
+            (x_off, y_off) = envelope.get_grid_offset(full_re, chunk_re)
+            full[y_off:y_off + chunk_re.y_size,
+                x_off:x_off + chunk_re.x_size] = arr
+        check = 50.0 - self.arr_3[:4, 6:]
+        check[0, 0] = -9999.0
+        np.testing.assert_array_equal(full, check)
+
+        self.assertRaises(algebra.ExpressionError, algebra.iter_evaluate,
+            'b4 - b5', self.datasets)
+
+    def test_integer_rasters(self):
+        """
+        Test NDVI over unsigned integer rasters
+        """
+        arr_3 = np.full((4, 4), 3000, dtype=np.uint16)
+        arr_4 = np.full((4, 4), 1000, dtype=np.uint16)
+        datasets = {
+            'b3': create_dataset(arr_3, 0.0, 4.0, 1.0,
+                gdal_type=gdal.GDT_UInt16),
+            'b4': create_dataset(arr_4, 0.0, 4.0, 1.0,
+                gdal_type=gdal.GDT_UInt16),
+        }
+        chunks = list(algebra.iter_evaluate('(b4 - b3) / (b4 + b3)',
+            datasets))
+        self.assertEqual(len(chunks), 1)
+        np.testing.assert_allclose(chunks[0][1], -0.5)
+
+    def test_footprint(self):
+        """
+        Test that cells outside a footprint are nodata with method 'max'
+        """
+        ds_5 = create_dataset(np.full((4, 4), 5.0, dtype=np.float32), 8.0,
+            12.0, 1.0)
+        datasets = {'b3': self.ds_3, 'b5': ds_5}
+        full = {}
+        for (chunk_re, arr) in algebra.iter_evaluate('b3 + b5', datasets,
+                chunk_size=(5, 5), method='max', nodata=-9999.0):
+            full[envelope.get_grid_offset(
+                envelope.RasterEnvelope(0.0, 0.0, 12.0, 12.0, 1.0),
+                chunk_re)] = arr.copy()
+        self.assertEqual(len(full), 9)
+
+        # b5 covers rows 0-3 and columns 8-11; b3 covers rows 2-11 and
+        # columns 0-9, so only rows 2-3 and columns 8-9 overlap
+        np.testing.assert_array_equal(full[(0, 0)], -9999.0)
+        np.testing.assert_array_equal(full[(5, 0)][2:4, 3:5],
+            self.arr_3[:2, 8:10] + 5.0)
+        np.testing.assert_array_equal(full[(5, 0)][:2], -9999.0)
+        np.testing.assert_array_equal(full[(5, 0)][2:4, :3], -9999.0)
+        np.testing.assert_array_equal(full[(10, 0)][2:4, 0], -9999.0)
+
+    def test_evaluate_to_file(self):
+        """
+        Test streaming the result to a GeoTIFF
+        """
+        path = os.path.join(self.temp_dir, 'ndvi.tif')
+        raster_env = algebra.evaluate_to_file('(b4 - b3) / (b4 + b3)',
+            self.datasets, path, chunk_size=(3, 3), nodata=-9999.0,
+            overviews=())
+        ds = gdal.Open(path)
+        self.assert_(envelope.RasterEnvelope.from_gdal_dataset(ds) ==
+            raster_env)
+        arr = ds.GetRasterBand(1).ReadAsArray()
+        sub = self.arr_3[:4, 6:]
+        check = ((50.0 - sub) / (50.0 + sub)).astype(np.float32)
+        check[0, 0] = -9999.0
+        np.testing.assert_allclose(arr, check, rtol=1e-6)
+
+    def test_compiled_expression(self):
+        """
+        Test that a compiled Expression supplies the nodata and type
+        """
+        expr = algebra.Expression('b4 / b3', dtype=np.float64,
+            nodata=-9999.0)
+        path = os.path.join(self.temp_dir, 'ratio.tif')
+        algebra.evaluate_to_file(expr, self.datasets, path, overviews=())
+        band = gdal.Open(path).GetRasterBand(1)
+        self.assertEqual(band.GetNoDataValue(), -9999.0)
+        self.assertEqual(band.ReadAsArray().dtype, np.float64)
+        self.assertEqual(band.ReadAsArray()[0, 0], -9999.0)
+
+        chunks = list(algebra.iter_evaluate(expr, self.datasets,
+            nodata=-9999.0, dtype=np.float64))
+        self.assertEqual(chunks[0][1].dtype, np.float64)
+
+        self.assertRaises(algebra.ExpressionError, algebra.evaluate_to_file,
+            expr, self.datasets, path, nodata=0.0)
+        self.assertRaises(algebra.ExpressionError, algebra.iter_evaluate,
+            expr, self.datasets, dtype=np.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
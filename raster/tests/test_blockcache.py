@@ -0,0 +1,155 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for BlockCache and CachedReader classes
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from spatial_tools.raster import blockcache
+from spatial_tools.raster import envelope
+
+
+class BlockCacheTest(unittest.TestCase):
+    """
+    BlockCache class tests
+    """
+    def test_lru(self):
+        """
+        Test byte budget and least-recently-used eviction
+        """
+        cache = blockcache.BlockCache(max_bytes=250)
+        for i in range(3):
+            cache.put(i, np.zeros(10, dtype=np.float64))
+        self.assertEqual(cache.n_bytes, 240)
+        self.assertIsNotNone(cache.get(0))
+        cache.put(3, np.zeros(10, dtype=np.float64))
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(0))
+        stats = cache.stats
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['n_blocks'], 3)
+
+        # Oversized blocks are not cached and shrinking the budget evicts
+        cache.put(4, np.zeros(100, dtype=np.float64))
+        self.assertIsNone(cache.get(4))
+        cache.set_max_bytes(100)
+        self.assertEqual(len(cache), 1)
+
+    def test_read_only(self):
+        """
+        Test that cached blocks cannot be modified by readers
+        """
+        cache = blockcache.BlockCache()
+        cache.put('a', np.zeros(4))
+        arr = cache.get('a')
+        self.assertRaises(ValueError, arr.__setitem__, 0, 1.0)
+
+
+class CachedReaderTest(unittest.TestCase):
+    """
+    CachedReader class tests
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'tiled.tif')
+        self.arr = np.arange(40 * 50, dtype=np.int16).reshape(40, 50)
+        driver = gdal.GetDriverByName('GTiff')
+        ds = driver.Create(self.path, 50, 40, 1, gdal.GDT_Int16,
+            options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+        ds.SetGeoTransform([0.0, 1.0, 0.0, 40.0, 0.0, -1.0])
+        ds.GetRasterBand(1).WriteArray(self.arr)
+        ds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read(self):
+        """
+        Test windows assembled from cached blocks
+        """
+        cache = blockcache.BlockCache()
+        reader = blockcache.CachedReader(self.path, cache=cache)
+        self.assertEqual(reader.block_size, (16, 16))
+
+        (window_re, arr) = reader.read(envelope.Envelope(10.5, 20.0, 20.0,
+            30.5))
+        self.assert_(window_re == envelope.RasterEnvelope(10.0, 20.0, 20.0,
+            31.0, 1.0))
+        np.testing.assert_array_equal(arr, self.arr[9:20, 10:20])
+        self.assertEqual(cache.stats['misses'], 4)
+
+        # Overlapping window is served from cache
+        (_, arr) = reader.read(envelope.Envelope(12.0, 22.0, 18.0, 28.0))
+        np.testing.assert_array_equal(arr, self.arr[12:18, 12:18])
+        self.assertEqual(cache.stats['misses'], 4)
+        self.assertEqual(cache.stats['hits'], 4)
+
+        # Window extending past the raster
+        arr = reader.read_offsets(45, 35, 10, 10, fill_value=-1)
+        np.testing.assert_array_equal(arr[:5, :5], self.arr[35:, 45:])
+        np.testing.assert_array_equal(arr[5:], -1)
+        self.assertEqual(arr.dtype, np.int16)
+
+        self.assertRaises(blockcache.BlockCacheError, reader.read_offsets,
+            0, 0, 1, 1, band_num=2)
+
+    def test_fill_dtype(self):
+        """
+        Test off-edge reads with a fill value outside the band type
+        """
+        path = os.path.join(self.tmp_dir, 'byte.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        ds = driver.Create(path, 20, 20, 1, gdal.GDT_Byte,
+            options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+        ds.SetGeoTransform([0.0, 1.0, 0.0, 20.0, 0.0, -1.0])
+        ds.GetRasterBand(1).WriteArray(np.full((20, 20), 200, dtype=np.uint8))
+        ds = None
+
+        reader = blockcache.CachedReader(path, cache=blockcache.BlockCache())
+        arr = reader.read_offsets(15, 15, 10, 10, fill_value=-9999)
+        self.assertEqual(arr.dtype, np.int16)
+        np.testing.assert_array_equal(arr[:5, :5], 200)
+        np.testing.assert_array_equal(arr[5:], -9999)
+
+        # Fill values that fit keep the band type
+        arr = reader.read_offsets(15, 15, 10, 10, fill_value=255)
+        self.assertEqual(arr.dtype, np.uint8)
+
+    def test_threads(self):
+        """
+        Test concurrent readers sharing a cache
+        """
+        cache = blockcache.BlockCache()
+        reader = blockcache.CachedReader(self.path, cache=cache)
+        errors = []
+
+        def read_all():
+            for y_off in range(0, 40, 7):
+                for x_off in range(0, 50, 9):
+                    arr = reader.read_offsets(x_off, y_off, 9, 7)
+                    expected = self.arr[y_off:y_off + 7, x_off:x_off + 9]
+                    if not np.array_equal(arr[:expected.shape[0],
+                            :expected.shape[1]], expected):
+                        errors.append((x_off, y_off))
+
+        threads = [threading.Thread(target=read_all) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(cache), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
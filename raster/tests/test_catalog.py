@@ -0,0 +1,117 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for RasterCatalog class
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from osgeo import gdal
+
+from spatial_tools.raster import catalog
+from spatial_tools.raster import envelope
+
+
+def create_raster(path, x_min, y_max, x_size, y_size, cell_size,
+        n_bands=1, gdal_type=gdal.GDT_Byte):
+    """
+    Create an empty GeoTIFF
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, x_size, y_size, n_bands, gdal_type)
+    ds.SetGeoTransform([x_min, cell_size, 0.0, y_max, 0.0, -cell_size])
+    ds = None
+
+
+class RasterCatalogTest(unittest.TestCase):
+    """
+    RasterCatalog class tests
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(os.path.join(self.data_dir, 'sub'))
+        self.db_path = os.path.join(self.tmp_dir, 'catalog.db')
+        self.paths = [
+            os.path.join(self.data_dir, 'a.tif'),
+            os.path.join(self.data_dir, 'sub', 'b.tif'),
+            os.path.join(self.data_dir, 'sub', 'c.tif'),
+        ]
+        create_raster(self.paths[0], 0.0, 100.0, 10, 10, 10.0)
+        create_raster(self.paths[1], 95.0, 200.0, 10, 10, 10.0, n_bands=3,
+            gdal_type=gdal.GDT_Float32)
+        create_raster(self.paths[2], 1000.0, 1000.0, 20, 20, 30.0)
+        with open(os.path.join(self.data_dir, 'notes.txt'), 'w') as fh:
+            fh.write('not a raster')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_signature(self):
+        """
+        Test grid signatures of snapped and unsnapped envelopes
+        """
+        re_1 = envelope.RasterEnvelope(0.0, 0.0, 100.0, 100.0, 10.0)
+        re_2 = envelope.RasterEnvelope(-30.0, 20.0, 50.0, 200.0, 10.0)
+        re_3 = envelope.RasterEnvelope(5.0, 0.0, 105.0, 100.0, 10.0)
+        self.assertEqual(catalog.get_grid_signature(re_1),
+            catalog.get_grid_signature(re_2))
+        self.assertNotEqual(catalog.get_grid_signature(re_1),
+            catalog.get_grid_signature(re_3))
+
+    def test_scan(self):
+        """
+        Test initial and incremental scans
+        """
+        with catalog.RasterCatalog(self.db_path) as cat:
+            counts = cat.scan([self.data_dir], n_workers=2)
+            self.assertEqual(counts['added'], 3)
+            self.assertEqual(len(cat), 3)
+
+            entries = cat.query()
+            self.assertEqual([e.path for e in entries], self.paths)
+            self.assertEqual(entries[1].band_count, 3)
+            self.assertEqual(entries[1].dtype, 'Float32')
+            self.assert_(entries[0].envelope == envelope.RasterEnvelope(
+                0.0, 0.0, 100.0, 100.0, 10.0))
+
+        # Reopen, modify one file and remove another
+        create_raster(self.paths[0], 0.0, 100.0, 20, 10, 10.0)
+        os.utime(self.paths[0], (0, 0))
+        os.remove(self.paths[2])
+        with catalog.RasterCatalog(self.db_path) as cat:
+            counts = cat.scan([self.data_dir])
+            self.assertEqual(counts['updated'], 1)
+            self.assertEqual(counts['unchanged'], 1)
+            self.assertEqual(counts['removed'], 1)
+            self.assertEqual(cat.query()[0].envelope.x_size, 20)
+
+            # A changed file that can no longer be read is dropped
+            with open(self.paths[1], 'w') as fh:
+                fh.write('corrupt')
+            counts = cat.scan([self.data_dir])
+            self.assertEqual(counts['failed'], 1)
+            self.assertIn(self.paths[1], cat.failed)
+            self.assertEqual([e.path for e in cat.query()], self.paths[:1])
+
+    def test_query(self):
+        """
+        Test spatial and signature queries
+        """
+        with catalog.RasterCatalog(self.db_path) as cat:
+            cat.scan([self.data_dir], use_processes=True)
+            entries = cat.query(envelope.Envelope(50.0, 50.0, 150.0, 150.0))
+            self.assertEqual([e.path for e in entries], self.paths[:2])
+            entries = cat.query(envelope.Envelope(100.0, 0.0, 101.0, 100.0))
+            self.assertEqual(entries, [])
+
+            signature = cat.query()[0].signature
+            entries = cat.query(signature=signature)
+            self.assertEqual([e.path for e in entries], self.paths[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for space-filling curve functions
+"""
+
+import unittest
+
+import numpy as np
+
+from spatial_tools.raster import curves
+from spatial_tools.raster import envelope
+
+
+class CurveKeyTest(unittest.TestCase):
+    """
+    Curve key function tests
+    """
+    def test_morton(self):
+        """
+        Test bit interleaving of Morton keys
+        """
+        keys = curves.morton_key([0, 1, 0, 1, 2, 3], [0, 0, 1, 1, 0, 3])
+        self.assertEqual(list(keys), [0, 1, 2, 3, 4, 15])
+        self.assertEqual(int(curves.morton_key(2 ** 31 - 1, 2 ** 31 - 1)),
+            2 ** 62 - 1)
+
+    def test_hilbert(self):
+        """
+        Test the Hilbert curve visits every cell once with unit steps
+        """
+        keys = curves.hilbert_key([0, 0, 1, 1], [0, 1, 1, 0], 1)
+        self.assertEqual(list(keys), [0, 1, 2, 3])
+
+        order = 4
+        n = 2 ** order
+        (y, x) = np.mgrid[0:n, 0:n]
+        keys = curves.hilbert_key(x.ravel(), y.ravel(), order)
+        self.assertEqual(sorted(keys), list(range(n * n)))
+        ordered = np.argsort(keys)
+        steps = np.abs(np.diff(x.ravel()[ordered])) + \
+            np.abs(np.diff(y.ravel()[ordered]))
+        self.assertTrue(np.all(steps == 1))
+
+        self.assertRaises(envelope.EnvelopeError, curves.hilbert_key, 0, 0,
+            0)
+
+    def test_point_keys(self):
+        """
+        Test keys for points relative to a parent extent
+        """
+        parent = envelope.Envelope(0.0, 0.0, 100.0, 100.0)
+        keys = curves.get_point_keys([10.0, 10.0, 90.0, 90.0, -50.0],
+            [90.0, 10.0, 10.0, 90.0, 150.0], parent, order=1)
+        self.assertEqual(list(keys), [0, 1, 2, 3, 0])
+        keys = curves.get_point_keys([10.0, 90.0, 10.0, 90.0],
+            [90.0, 90.0, 10.0, 10.0], parent, curve='morton', order=1)
+        self.assertEqual(list(keys), [0, 1, 2, 3])
+        self.assertRaises(envelope.EnvelopeError, curves.get_point_keys,
+            [0.0], [0.0], parent, curve='peano')
+
+
+class CurveOrderTest(unittest.TestCase):
+    """
+    Sorting and partitioning tests
+    """
+    def setUp(self):
+        self.re = envelope.RasterEnvelope(0.0, 0.0, 80.0, 80.0, 1.0)
+        self.tiles = envelope.get_tiles(self.re, 10)
+
+    def test_sort(self):
+        """
+        Test tiles sorted along the Hilbert curve are always adjacent
+        """
+        sorted_tiles = curves.sort_by_curve(self.tiles, self.re)
+        self.assertEqual(len(sorted_tiles), 64)
+        keys = curves.get_envelope_keys(sorted_tiles, self.re)
+        self.assertEqual(len(set(keys)), 64)
+        for (a, b) in zip(sorted_tiles[:-1], sorted_tiles[1:]):
+            self.assertFalse(a.is_disjoint(b))
+        self.assertEqual(curves.sort_by_curve([], self.re), [])
+
+    def test_partition(self):
+        """
+        Test partitions are balanced and spatially compact
+        """
+        parts = curves.partition_by_curve(self.tiles, self.re, 4)
+        self.assertEqual([len(p) for p in parts], [16, 16, 16, 16])
+
+        # Each part of a Hilbert curve over a square is one quadrant
+        for part in parts:
+            bounds = envelope.max_of(part)
+            self.assertEqual((bounds.x_size, bounds.y_size), (40, 40))
+
+        parts = curves.partition_by_curve(self.tiles[:5], self.re, 3)
+        self.assertEqual([len(p) for p in parts], [2, 2, 1])
+        self.assertRaises(envelope.EnvelopeError, curves.partition_by_curve,
+            self.tiles, self.re, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for DirtyRegionTracker class
+"""
+
+import unittest
+
+from spatial_tools.raster import dirty
+from spatial_tools.raster import envelope
+
+
+class DirtyRegionTrackerTest(unittest.TestCase):
+    """
+    DirtyRegionTracker class tests
+    """
+    def setUp(self):
+        self.re = envelope.RasterEnvelope(0.0, 0.0, 100.0, 100.0, 1.0)
+
+    def test_dirty_tiles(self):
+        """
+        Test resolution of changed envelopes to tiles
+        """
+        tracker = dirty.DirtyRegionTracker(self.re, 25)
+        self.assertEqual(tracker.get_dirty_tiles(), [])
+
+        # Spans the middle two tiles of the second column
+        tracker.add(envelope.Envelope(30.0, 30.0, 40.0, 60.0))
+        tiles = tracker.get_dirty_tiles()
+        self.assertEqual(len(tiles), 2)
+        self.assert_(tiles[0] == self.re.get_window(25, 25, 25, 25))
+        self.assert_(tiles[1] == self.re.get_window(25, 50, 25, 25))
+
+        # Overlapping change adds the two tiles of the third column and no
+        # duplicates
+        tracker.add(envelope.Envelope(35.0, 40.0, 55.0, 55.0))
+        self.assertEqual(len(tracker), 4)
+
+        tracker.clear()
+        self.assertEqual(len(tracker), 0)
+
+    def test_edges(self):
+        """
+        Test envelopes on tile boundaries and outside of the grid
+        """
+        tracker = dirty.DirtyRegionTracker(self.re, 30, 40)
+
+        # Touching the boundary of a tile does not dirty it
+        tracker.add(envelope.Envelope(0.0, 60.0, 30.0, 100.0))
+        tiles = tracker.get_dirty_tiles()
+        self.assertEqual(len(tiles), 1)
+        self.assert_(tiles[0] == self.re.get_window(0, 0, 30, 40))
+
+        # Truncated edge tiles
+        tracker.add(envelope.Envelope(95.0, -10.0, 120.0, 5.0))
+        tiles = tracker.get_dirty_tiles()
+        self.assertEqual(len(tiles), 2)
+        self.assertEqual((tiles[1].x_size, tiles[1].y_size), (10, 20))
+
+        # Outside of the grid
+        tracker.add(envelope.Envelope(200.0, 200.0, 300.0, 300.0))
+        self.assertEqual(len(tracker), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
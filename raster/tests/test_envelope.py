@@ -88,6 +88,36 @@ class EnvelopeTest(unittest.TestCase):
         c = a.intersection(b)
         self.assertEqual(c, intersection)
 
+    def test_difference(self):
+        """
+        Test the difference operation
+        """
+        a = envelope.Envelope(0.0, 0.0, 10.0, 10.0)
+
+        # Hole in the middle gives four disjoint pieces
+        pieces = a.difference(envelope.Envelope(3.0, 3.0, 7.0, 7.0))
+        self.assertEqual(pieces, [
+            envelope.Envelope(0.0, 7.0, 10.0, 10.0),
+            envelope.Envelope(0.0, 0.0, 10.0, 3.0),
+            envelope.Envelope(0.0, 3.0, 3.0, 7.0),
+            envelope.Envelope(7.0, 3.0, 10.0, 7.0)])
+        area = sum((p.x_max - p.x_min) * (p.y_max - p.y_min) for p in pieces)
+        self.assertEqual(area, 84.0)
+
+        # Overlapping corner
+        pieces = a.difference(envelope.Envelope(5.0, 5.0, 15.0, 15.0))
+        self.assertEqual(pieces, [
+            envelope.Envelope(0.0, 0.0, 10.0, 5.0),
+            envelope.Envelope(0.0, 5.0, 5.0, 10.0)])
+
+        # Subset, disjoint and touching
+        self.assertEqual(a.difference(envelope.Envelope(-1.0, -1.0, 11.0,
+            11.0)), [])
+        self.assertEqual(a.difference(envelope.Envelope(20.0, 20.0, 30.0,
+            30.0)), [a])
+        self.assertEqual(a.difference(envelope.Envelope(10.0, 0.0, 20.0,
+            10.0)), [a])
+
 
 class RasterEnvelopeTest(unittest.TestCase):
     """
@@ -346,6 +376,119 @@ class RasterEnvelopeTest(unittest.TestCase):
         max_re = envelope.max_of((re_2, re_1, re_3))
         self.assert_(check_re == max_re)
 
+    def test_from_origin(self):
+        """
+        Test method from_origin
+        """
+        re = envelope.RasterEnvelope.from_origin(0.1, 1.0, 0.1, 3, 7)
+        self.assertEqual((re.x_size, re.y_size), (3, 7))
+        self.assertAlmostEqual(re.x_max, 0.4)
+        self.assertAlmostEqual(re.y_min, 0.3)
+
+    def test_get_window(self):
+        """
+        Test method get_window
+        """
+        re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+        window_re = re.get_window(2, 3, 4, 5)
+        check_re = envelope.RasterEnvelope(2.0, 2.0, 6.0, 7.0, 1.0)
+        self.assert_(window_re == check_re)
+        self.assertEqual(window_re.x_max, 6.0)
+        self.assertEqual(window_re.y_min, 2.0)
+        self.assertTrue(window_re.is_snapped_subset(re))
+
+        # Windows may extend past the parent envelope
+        window_re = re.get_window(-1, -1, 12, 12)
+        check_re = envelope.RasterEnvelope(-1.0, -1.0, 11.0, 11.0, 1.0)
+        self.assert_(window_re == check_re)
+
+        # Sizes are preserved even when coordinates are inexact
+        re = envelope.RasterEnvelope(0.0, 0.0, 1.0, 1.0, 0.1)
+        window_re = re.get_window(1, 1, 3, 3)
+        self.assertEqual(window_re.x_size, 3)
+        self.assertEqual(window_re.y_size, 3)
+
+        self.assertRaises(envelope.EnvelopeError, re.get_window, 0, 0, 0, 1)
+
+    def test_get_tiles(self):
+        """
+        Test function get_tiles
+        """
+        re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+        tiles = envelope.get_tiles(re, 4)
+        self.assertEqual(len(tiles), 9)
+        self.assertEqual([(t.x_size, t.y_size) for t in tiles[:3]],
+            [(4, 4), (4, 4), (2, 4)])
+        self.assertEqual((tiles[-1].x_size, tiles[-1].y_size), (2, 2))
+        self.assert_(tiles[0] == envelope.RasterEnvelope(
+            0.0, 6.0, 4.0, 10.0, 1.0))
+        self.assert_(tiles[-1] == envelope.RasterEnvelope(
+            8.0, 0.0, 10.0, 2.0, 1.0))
+        self.assertEqual(sum(t.x_size * t.y_size for t in tiles), 100)
+
+        tiles = envelope.get_tiles(re, 10, 5)
+        self.assertEqual(len(tiles), 2)
+        self.assertRaises(envelope.EnvelopeError, envelope.get_tiles, re, 0)
+
+    def test_get_grid_offset(self):
+        """
+        Test function get_grid_offset
+        """
+        re_1 = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+        re_2 = envelope.RasterEnvelope(2.0, 1.0, 5.0, 7.0, 1.0)
+        self.assertEqual(envelope.get_grid_offset(re_1, re_2), (2, 3))
+        self.assertEqual(envelope.get_grid_offset(re_2, re_1), (-2, -3))
+
+        re_3 = envelope.RasterEnvelope(2.5, 1.0, 5.5, 7.0, 1.0)
+        self.assertRaises(envelope.EnvelopeError, envelope.get_grid_offset,
+            re_1, re_3)
+
+    def test_difference(self):
+        """
+        Test snapped difference of RasterEnvelopes
+        """
+        re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+
+        pieces = re.difference(envelope.RasterEnvelope(3.0, 3.0, 7.0, 7.0,
+            1.0))
+        self.assertEqual(len(pieces), 4)
+        self.assertEqual(sum(p.x_size * p.y_size for p in pieces), 84)
+        for p in pieces:
+            self.assertTrue(p.is_snapped_subset(re))
+        self.assert_(pieces[0] == envelope.RasterEnvelope(0.0, 7.0, 10.0,
+            10.0, 1.0))
+
+        # Partially covered cells are kept
+        pieces = re.difference(envelope.Envelope(2.5, -1.0, 11.0, 11.0))
+        self.assertEqual(len(pieces), 1)
+        self.assert_(pieces[0] == envelope.RasterEnvelope(0.0, 0.0, 3.0,
+            10.0, 1.0))
+
+        # Subset and disjoint
+        self.assertEqual(re.difference(envelope.Envelope(-1.0, -1.0, 11.0,
+            11.0)), [])
+        pieces = re.difference(envelope.Envelope(2.2, 2.2, 2.8, 2.8))
+        self.assert_(pieces == [re])
+
+    def test_get_cell_range(self):
+        """
+        Test function get_cell_range
+        """
+        re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+        env = envelope.Envelope(2.5, 3.0, 5.0, 7.5)
+        self.assertEqual(envelope.get_cell_range(re, env), (2, 2, 5, 7))
+        self.assertEqual(envelope.get_cell_range(re, env, inside=True),
+            (3, 3, 5, 7))
+
+        # Clipped to the grid
+        env = envelope.Envelope(-5.0, -5.0, 3.0, 3.0)
+        self.assertEqual(envelope.get_cell_range(re, env), (0, 7, 3, 10))
+
+        # Near-boundary coordinates are not rounded outwards
+        re = envelope.RasterEnvelope(0.0, 0.0, 1.0, 1.0, 0.1)
+        env = envelope.Envelope(0.1 + 0.2, 0.0, 0.7, 1.0)
+        self.assertEqual(envelope.get_cell_range(re, env), (3, 0, 7, 10))
+
     def test_from_gdal_dataset(self):
         """
         Test method from_gdal_dataset
@@ -0,0 +1,100 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for FixedGridEnvelope class
+"""
+
+import unittest
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import fixedgrid
+
+
+class FixedGridEnvelopeTest(unittest.TestCase):
+    """
+    FixedGridEnvelope class tests
+    """
+    def test_default(self):
+        """
+        Test attributes and growing from the upper-left corner
+        """
+        e = fixedgrid.FixedGridEnvelope(0, 3, 96, 100, 10, 0.1)
+        self.assertEqual((e.x_min, e.y_min, e.x_max, e.y_max),
+            (0, 0, 100, 100))
+        self.assertEqual((e.x_size, e.y_size), (10, 10))
+        self.assertRaises(envelope.EnvelopeError,
+            fixedgrid.FixedGridEnvelope, 0, 0, 0, 10, 1, 0.1)
+        self.assertRaises(envelope.EnvelopeError,
+            fixedgrid.FixedGridEnvelope, 0, 0, 10, 10, 0, 0.1)
+
+    def test_conversion(self):
+        """
+        Test round trip to and from RasterEnvelope
+        """
+        re = envelope.RasterEnvelope(0.1, 0.2, 1.0, 1.0, 0.1)
+        e = fixedgrid.FixedGridEnvelope.from_raster_envelope(re, 0.001)
+        self.assertEqual((e.x_min, e.y_min, e.x_max, e.y_max, e.cell_size),
+            (100, 200, 1000, 1000, 100))
+        self.assertEqual((e.x_size, e.y_size), (re.x_size, re.y_size))
+        re_2 = e.to_raster_envelope()
+        self.assert_(re == re_2)
+        self.assertEqual((re_2.x_size, re_2.y_size), (9, 8))
+
+        self.assertEqual(fixedgrid.to_units(0.1 + 0.2, 0.1), 3)
+        self.assertRaises(envelope.EnvelopeError, fixedgrid.to_units, 0.15,
+            0.1)
+
+    def test_equality(self):
+        """
+        Test exact equality and hashing
+        """
+        a = fixedgrid.FixedGridEnvelope(0, 0, 100, 100, 10, 0.1)
+        b = fixedgrid.FixedGridEnvelope(0, 1, 95, 100, 10, 0.1)
+        c = fixedgrid.FixedGridEnvelope(0, 0, 100, 100, 10, 0.01)
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, c)
+        self.assertEqual(len(set([a, b, c])), 2)
+
+    def test_snapping(self):
+        """
+        Test snapping and set operations
+        """
+        a = fixedgrid.FixedGridEnvelope(0, 0, 100, 100, 10, 1.0)
+        b = fixedgrid.FixedGridEnvelope(5, 5, 45, 45, 10, 1.0)
+        self.assertFalse(a.is_snapped(b))
+        self.assertTrue(b.is_subset(a))
+        self.assertTrue(a.is_superset(b))
+        self.assertFalse(a.is_disjoint(b))
+
+        self.assertEqual(a.snap(5, 5, 45, 45),
+            fixedgrid.FixedGridEnvelope(0, 0, 50, 50, 10, 1.0))
+        self.assertEqual(a.intersection(b),
+            fixedgrid.FixedGridEnvelope(0, 0, 50, 50, 10, 1.0))
+        self.assertEqual(b.intersection(a), b)
+
+        c = fixedgrid.FixedGridEnvelope(90, -20, 150, 30, 10, 1.0)
+        self.assertEqual(a.union(c),
+            fixedgrid.FixedGridEnvelope(0, -20, 150, 100, 10, 1.0))
+        self.assertEqual(b.union(c),
+            fixedgrid.FixedGridEnvelope(5, -25, 155, 45, 10, 1.0))
+
+        d = fixedgrid.FixedGridEnvelope(200, 200, 300, 300, 10, 1.0)
+        self.assertRaises(envelope.EnvelopeError, a.intersection, d)
+        e = fixedgrid.FixedGridEnvelope(0, 0, 100, 100, 5, 1.0)
+        self.assertRaises(envelope.EnvelopeError, a.union, e)
+
+    def test_offsets(self):
+        """
+        Test conversion between coordinates and offsets
+        """
+        a = fixedgrid.FixedGridEnvelope(0, 0, 100, 100, 10, 1.0)
+        self.assertEqual(a.get_offset_from_xy(3, 95), (0, 0))
+        self.assertEqual(a.get_offset_from_xy(97, 3), (9, 9))
+        self.assertEqual(a.get_xy_from_offset(2, 3), (20, 70))
+        self.assertEqual(a.get_window(2, 3, 4, 5),
+            fixedgrid.FixedGridEnvelope(20, 20, 60, 70, 10, 1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for batch envelope reprojection
+"""
+
+import unittest
+
+import numpy as np
+from osgeo import osr
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import reproject
+
+
+class DensifyTest(unittest.TestCase):
+    """
+    Edge densification tests
+    """
+    def test_densify(self):
+        """
+        Test edge points run clockwise from the upper-left corner
+        """
+        envs = [envelope.Envelope(0.0, 0.0, 4.0, 2.0),
+            envelope.Envelope(10.0, 10.0, 12.0, 11.0)]
+        (x, y) = reproject.densify_envelopes(envs, n_points=3)
+        self.assertEqual(x.shape, (2, 8))
+        np.testing.assert_array_equal(x[0],
+            [0.0, 2.0, 4.0, 4.0, 4.0, 2.0, 0.0, 0.0])
+        np.testing.assert_array_equal(y[0],
+            [2.0, 2.0, 2.0, 1.0, 0.0, 0.0, 0.0, 1.0])
+        self.assertEqual((x[1].min(), y[1].min(), x[1].max(), y[1].max()),
+            (10.0, 10.0, 12.0, 11.0))
+
+        self.assertRaises(reproject.ReprojectError,
+            reproject.densify_envelopes, envs, n_points=1)
+
+
+class EnvelopeTransformerTest(unittest.TestCase):
+    """
+    EnvelopeTransformer class tests
+    """
+    def setUp(self):
+        """
+        Create UTM zone 10N envelopes, one spanning several hundred km
+        """
+        self.envs = [
+            envelope.Envelope(300000.0, 4000000.0, 800000.0, 4600000.0),
+            envelope.Envelope(500000.0, 4100000.0, 510000.0, 4110000.0),
+        ]
+
+    def test_identity(self):
+        """
+        Test that reprojecting to the same system is lossless
+        """
+        for backend in ['osr'] + (['pyproj'] if reproject.pyproj else []):
+            dst_envs = reproject.reproject_envelopes(self.envs, 32610, 32610,
+                backend=backend)
+            for (env, dst_env) in zip(self.envs, dst_envs):
+                self.assertAlmostEqual(env.x_min, dst_env.x_min, places=4)
+                self.assertAlmostEqual(env.y_max, dst_env.y_max, places=4)
+
+    def test_densified_bounds(self):
+        """
+        Test that densified bounds contain every transformed edge point
+        and are larger than corner-only bounds
+        """
+        transformer = reproject.EnvelopeTransformer(32610, 'EPSG:5070',
+            backend='osr')
+        dense = transformer.transform_envelopes(self.envs, n_points=51)
+        corners = transformer.transform_envelopes(self.envs, n_points=2)
+        self.assert_(dense[0].is_superset(corners[0]))
+
+        # Lines of constant northing bow poleward at the central meridian,
+        # so corners alone undersize the geographic extent
+        transformer_4326 = reproject.EnvelopeTransformer(32610, 4326,
+            backend='osr')
+        dense_4326 = transformer_4326.transform_envelopes(self.envs)
+        corners_4326 = transformer_4326.transform_envelopes(self.envs,
+            n_points=2)
+        self.assert_(dense_4326[0].y_max > corners_4326[0].y_max)
+
+        # Compare against transforming a finer set of points one by one
+        src_sr = reproject.get_spatial_reference(32610)
+        dst_sr = reproject.get_spatial_reference(5070)
+        transform = osr.CoordinateTransformation(src_sr, dst_sr)
+        (x, y) = reproject.densify_envelopes(self.envs[:1], n_points=501)
+        points = [transform.TransformPoint(float(px), float(py))
+            for (px, py) in zip(x[0], y[0])]
+        check = envelope.Envelope(min(p[0] for p in points),
+            min(p[1] for p in points), max(p[0] for p in points),
+            max(p[1] for p in points))
+        self.assertAlmostEqual(dense[0].x_min, check.x_min, delta=1.0)
+        self.assertAlmostEqual(dense[0].y_max, check.y_max, delta=1.0)
+
+    def test_to_grid(self):
+        """
+        Test snapping reprojected envelopes to a target grid
+        """
+        snap_re = envelope.RasterEnvelope(-2700000.0, 1000000.0, -1500000.0,
+            3000000.0, 30.0)
+        transformer = reproject.EnvelopeTransformer(32610, 5070,
+            backend='osr')
+        dst_envs = transformer.transform_envelopes(self.envs)
+        raster_envs = transformer.transform_to_grid(self.envs, snap_re)
+        for (env, raster_env) in zip(dst_envs, raster_envs):
+            self.assert_(raster_env.is_superset(env))
+            self.assert_(raster_env.is_snapped(snap_re))
+            self.assert_(raster_env.x_max - env.x_max < 30.0)
+
+        far_re = envelope.RasterEnvelope(5000000.0, 5000000.0, 6000000.0,
+            6000000.0, 30.0)
+        self.assertEqual(transformer.transform_to_grid(self.envs, far_re),
+            [None, None])
+
+    def test_errors(self):
+        """
+        Test invalid backends and spatial references
+        """
+        self.assertRaises(reproject.ReprojectError,
+            reproject.EnvelopeTransformer, 32610, 4326, backend='proj4')
+        self.assertRaises(Exception, reproject.get_spatial_reference,
+            'not a spatial reference')
+        transformer = reproject.EnvelopeTransformer(32610, 4326,
+            backend='osr')
+        self.assertEqual(transformer.transform_envelopes([]), [])
+        self.assertRaises(reproject.ReprojectError,
+            transformer.transform_points, [1.0, 2.0], [1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for TileScheduler class
+"""
+
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import scheduler
+
+
+def _record_tile(db_path):
+    """
+    Return a function that records processed tiles in a separate database
+    """
+    def record(tile_re):
+        conn = sqlite3.connect(db_path, timeout=60.0)
+        with conn:
+            conn.execute('INSERT INTO tiles VALUES (?, ?, ?)',
+                (tile_re.x_min, tile_re.y_max, os.getpid()))
+        conn.close()
+    return record
+
+
+def _worker(db_path, results_path):
+    """
+    Worker process entry point
+    """
+    scheduler.run_worker(db_path, _record_tile(results_path),
+        poll_seconds=0.05)
+
+
+class TileSchedulerTest(unittest.TestCase):
+    """
+    TileScheduler class tests
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'queue.db')
+        self.re = envelope.RasterEnvelope(0.0, 0.0, 100.0, 100.0, 1.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_create(self):
+        """
+        Test shards cover the grid and re-creation resumes
+        """
+        with scheduler.TileScheduler(self.db_path) as s:
+            self.assertTrue(s.create(self.re, 10, shard_size=16))
+            self.assertEqual(s.get_progress()[scheduler.PENDING], 7)
+            self.assert_(s.raster_env == self.re)
+
+            tiles = []
+            shard = s.claim('a')
+            while shard is not None:
+                tiles.extend(shard.tiles)
+                shard = s.claim('a')
+            self.assertEqual(len(tiles), 100)
+            self.assertEqual(sum(t.x_size * t.y_size for t in tiles), 10000)
+
+        with scheduler.TileScheduler(self.db_path) as s:
+            self.assertFalse(s.create(self.re, 10, shard_size=16))
+            self.assertRaises(scheduler.SchedulerError, s.create, self.re,
+                20)
+
+    def test_leases(self):
+        """
+        Test lease expiry, checkpoints and resume by another worker
+        """
+        with scheduler.TileScheduler(self.db_path, lease_seconds=0.2) as s:
+            s.create(self.re, 50, shard_size=4)
+            shard = s.claim('a')
+            self.assertEqual(len(shard.tiles), 4)
+            self.assertTrue(s.checkpoint(shard.shard_id, 0, 'a'))
+            self.assertTrue(s.checkpoint(shard.shard_id, 1, 'a'))
+            self.assertIsNone(s.claim('b'))
+
+            # Worker a dies; b takes over after the lease expires
+            time.sleep(0.3)
+            resumed = s.claim('b')
+            self.assertEqual(resumed.shard_id, shard.shard_id)
+            self.assertEqual(resumed.done, set([0, 1]))
+            self.assertEqual(resumed.attempts, 2)
+            self.assertFalse(s.checkpoint(shard.shard_id, 2, 'a'))
+            self.assertFalse(s.complete(shard.shard_id, 'a'))
+            self.assertTrue(s.complete(shard.shard_id, 'b'))
+            self.assertTrue(s.is_finished())
+            self.assertEqual(s.get_progress()['tiles_done'], 2)
+
+    def test_failures(self):
+        """
+        Test retries and failure after max_attempts
+        """
+        with scheduler.TileScheduler(self.db_path, max_attempts=2) as s:
+            s.create(self.re, 100)
+            shard = s.claim('a')
+            self.assertTrue(s.fail(shard.shard_id, 'boom', 'a'))
+            shard = s.claim('a')
+            self.assertTrue(s.fail(shard.shard_id, 'boom', 'a'))
+            self.assertIsNone(s.claim('a'))
+            self.assertEqual(s.get_progress()[scheduler.FAILED], 1)
+            s.reset_failed()
+            self.assertIsNotNone(s.claim('a'))
+
+    def test_processes(self):
+        """
+        Test several worker processes share the queue and process every
+        tile exactly once
+        """
+        results_path = os.path.join(self.tmp_dir, 'results.db')
+        conn = sqlite3.connect(results_path)
+        conn.execute('CREATE TABLE tiles (x REAL, y REAL, pid INTEGER)')
+        conn.commit()
+        with scheduler.TileScheduler(self.db_path) as s:
+            s.create(self.re, 10, shard_size=5)
+
+        procs = [multiprocessing.Process(target=_worker,
+            args=(self.db_path, results_path)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+        rows = conn.execute('SELECT x, y FROM tiles').fetchall()
+        conn.close()
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(len(set(rows)), 100)
+        with scheduler.TileScheduler(self.db_path) as s:
+            self.assertEqual(s.get_progress()[scheduler.DONE], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for RasterStack class
+"""
+
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import stack
+
+
+def create_dataset(arr, x_min, y_max, cell_size, nodata=None):
+    """
+    Create an in-memory GDAL dataset from a 2-D or 3-D array
+    """
+    if arr.ndim == 2:
+        arr = arr[np.newaxis]
+    (n_bands, y_size, x_size) = arr.shape
+    driver = gdal.GetDriverByName('MEM')
+    ds = driver.Create('', x_size, y_size, n_bands, gdal.GDT_Float32)
+    ds.SetGeoTransform([x_min, cell_size, 0.0, y_max, 0.0, -cell_size])
+    for i in range(n_bands):
+        band = ds.GetRasterBand(i + 1)
+        band.WriteArray(arr[i])
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+    return ds
+
+
+class RasterStackTest(unittest.TestCase):
+    """
+    RasterStack class tests
+    """
+    def setUp(self):
+        """
+        Create two overlapping datasets on the same grid
+        """
+        self.arr_1 = np.arange(100, dtype=np.float32).reshape(10, 10)
+        self.arr_2 = np.stack([np.full((6, 6), 1.0, dtype=np.float32),
+            np.full((6, 6), 2.0, dtype=np.float32)])
+        self.ds_1 = create_dataset(self.arr_1, 0.0, 10.0, 1.0)
+        self.ds_2 = create_dataset(self.arr_2, 6.0, 12.0, 1.0, nodata=-1.0)
+
+    def test_envelope(self):
+        """
+        Test the stack envelope for min and max methods
+        """
+        s = stack.RasterStack([self.ds_1, self.ds_2], method='min')
+        check_re = envelope.RasterEnvelope(6.0, 6.0, 10.0, 10.0, 1.0)
+        self.assert_(s.envelope == check_re)
+        self.assertEqual(s.shape, (3, 4, 4))
+        self.assertEqual(len(s), 3)
+
+        s = stack.RasterStack([self.ds_1, self.ds_2], method='max')
+        check_re = envelope.RasterEnvelope(0.0, 0.0, 12.0, 12.0, 1.0)
+        self.assert_(s.envelope == check_re)
+        self.assertEqual(s.shape, (3, 12, 12))
+
+        self.assertRaises(stack.RasterStackError, stack.RasterStack,
+            [self.ds_1], method='mean')
+        self.assertRaises(stack.RasterStackError, stack.RasterStack, [])
+
+    def test_misaligned(self):
+        """
+        Test that datasets off the stack grid are rejected
+        """
+        ds_3 = create_dataset(self.arr_1, 0.5, 10.5, 1.0)
+        self.assertRaises(envelope.EnvelopeError, stack.RasterStack,
+            [self.ds_1, ds_3])
+        ds_4 = create_dataset(self.arr_1, 0.0, 10.0, 2.0)
+        self.assertRaises(stack.RasterStackError, stack.RasterStack,
+            [self.ds_1, ds_4])
+
+    def test_read(self):
+        """
+        Test reading windows by Envelope with nodata fill
+        """
+        s = stack.RasterStack([self.ds_1, self.ds_2], method='max')
+        arr = s[envelope.Envelope(4.0, 6.0, 8.0, 9.0)]
+        self.assertEqual(arr.shape, (3, 3, 4))
+        np.testing.assert_array_equal(arr[0], self.arr_1[1:4, 4:8])
+
+        # ds_2 covers only the two rightmost columns of the window
+        np.testing.assert_array_equal(arr[1, :, :2], -1.0)
+        np.testing.assert_array_equal(arr[1, :, 2:], 1.0)
+        np.testing.assert_array_equal(arr[2, :, 2:], 2.0)
+
+        # Layer selection and clipping to the stack extent
+        arr = s[2, envelope.Envelope(-5.0, -5.0, 20.0, 20.0)]
+        self.assertEqual(arr.shape, (1, 12, 12))
+        self.assertEqual(arr[0, 0, 0], -1.0)
+        self.assertEqual(arr[0, 0, 11], 2.0)
+
+        # Unaligned envelopes grow to cover whole cells
+        arr = s.read(envelope.Envelope(0.5, 8.5, 1.5, 9.5), layers=[0])
+        np.testing.assert_array_equal(arr[0], self.arr_1[0:2, 0:2])
+
+    def test_fill_dtype(self):
+        """
+        Test that the stack type holds fill values outside the band type
+        """
+        driver = gdal.GetDriverByName('MEM')
+        datasets = []
+        for x_min in (0.0, 4.0):
+            ds = driver.Create('', 4, 4, 1, gdal.GDT_Byte)
+            ds.SetGeoTransform([x_min, 1.0, 0.0, 10.0, 0.0, -1.0])
+            ds.GetRasterBand(1).WriteArray(
+                np.full((4, 4), 7, dtype=np.uint8))
+            ds.GetRasterBand(1).SetNoDataValue(255)
+            datasets.append(ds)
+        ds = datasets[0]
+
+        s = stack.RasterStack([ds, self.ds_1], method='max')
+        self.assertEqual(s.dtype, np.float32)
+        s = stack.RasterStack(datasets, method='max', nodata=-9999)
+        self.assertEqual(s.dtype, np.int16)
+        arr = s.read(s.envelope, layers=[0])
+        np.testing.assert_array_equal(arr[0, :, :4], 7)
+        np.testing.assert_array_equal(arr[0, :, 4:], -9999)
+
+        # Nodata of 255 fits the band type
+        s = stack.RasterStack([ds])
+        self.assertEqual(s.dtype, np.uint8)
+        self.assertRaises(stack.RasterStackError, stack.RasterStack, [ds],
+            nodata=-9999, dtype=np.uint8)
+
+    def test_chunks(self):
+        """
+        Test chunked iteration covers the stack exactly once
+        """
+        s = stack.RasterStack([self.ds_1, self.ds_2], method='max',
+            chunk_size=(5, 5))
+        chunks = list(s.iter_chunks(layers=0))
+        self.assertEqual(len(chunks), 9)
+        full = np.zeros(s.shape[1:], dtype=s.dtype)
+        for (chunk_re, arr) in chunks:
+            (x_off, y_off) = envelope.get_grid_offset(s.envelope, chunk_re)
+            full[y_off:y_off + chunk_re.y_size,
+                x_off:x_off + chunk_re.x_size] = arr[0]
+        np.testing.assert_array_equal(full[2:, :10], self.arr_1)
+        np.testing.assert_array_equal(full[:2], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for streaming statistics
+"""
+
+import unittest
+
+import numpy as np
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import stats
+
+
+def _read_tile(tile_re):
+    """
+    Deterministic test raster: value is row * 1000 + column, with a nodata
+    block in the upper-left corner
+    """
+    (x_off, y_off) = (int(tile_re.x_min), int(100.0 - tile_re.y_max))
+    (rows, cols) = np.mgrid[y_off:y_off + tile_re.y_size,
+        x_off:x_off + tile_re.x_size]
+    arr = (rows * 1000 + cols).astype(np.float32)
+    arr[(rows < 10) & (cols < 10)] = -9999.0
+    return arr
+
+
+class StatisticsTest(unittest.TestCase):
+    """
+    Streaming statistics tests
+    """
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.values = rng.lognormal(size=100000)
+        self.chunks = np.array_split(self.values, 7)
+
+    def test_valid_values(self):
+        """
+        Test nodata and NaN masking
+        """
+        arr = np.array([[1.0, np.nan], [-1.0, 2.0]])
+        np.testing.assert_array_equal(stats.get_valid_values(arr, -1.0),
+            [1.0, 2.0])
+
+    def test_moments(self):
+        """
+        Test merged moments match whole-array moments
+        """
+        parts = []
+        for chunk in self.chunks:
+            m = stats.RunningMoments()
+            m.update(chunk)
+            parts.append(m)
+        total = stats.RunningMoments()
+        for m in parts:
+            total.merge(m)
+        self.assertEqual(total.count, self.values.size)
+        self.assertAlmostEqual(total.mean, self.values.mean())
+        self.assertAlmostEqual(total.variance, self.values.var())
+        self.assertEqual(total.min, self.values.min())
+        self.assertEqual(total.max, self.values.max())
+        self.assertTrue(np.isnan(stats.RunningMoments().mean))
+
+    def test_fixed_histogram(self):
+        """
+        Test fixed histogram counts and quantiles
+        """
+        h = stats.FixedHistogram(0.0, 10.0, n_bins=100)
+        for chunk in self.chunks:
+            part = stats.FixedHistogram(0.0, 10.0, n_bins=100)
+            part.update(chunk)
+            h.merge(part)
+        expected = np.histogram(self.values, bins=h.edges)[0]
+        np.testing.assert_array_equal(h.counts, expected)
+        self.assertEqual(h.over, int((self.values > 10.0).sum()))
+        self.assertEqual(h.count, self.values.size)
+        self.assertAlmostEqual(float(h.quantile(0.5)),
+            np.median(self.values), places=1)
+        self.assertRaises(stats.StatisticsError, h.merge,
+            stats.FixedHistogram(0.0, 5.0, n_bins=100))
+
+    def test_quantiles(self):
+        """
+        Test adaptive histogram and t-digest quantile accuracy after merges
+        """
+        q = np.array([0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999])
+        expected = np.quantile(self.values, q)
+        for cls in (stats.AdaptiveHistogram, stats.TDigest):
+            total = cls()
+            for chunk in self.chunks:
+                part = cls()
+                part.update(chunk)
+                total.merge(part)
+            self.assertEqual(total.count, self.values.size)
+            estimate = total.quantile(q)
+            ranks = np.searchsorted(np.sort(self.values), estimate) / \
+                float(self.values.size)
+            np.testing.assert_allclose(ranks, q, atol=0.01)
+            self.assertEqual(float(total.quantile(0.0)), self.values.min())
+            self.assertEqual(float(total.quantile(1.0)), self.values.max())
+
+        # t-digest is accurate in the tails
+        d = stats.TDigest()
+        d.update(self.values)
+        ranks = np.searchsorted(np.sort(self.values), d.quantile(q)) / \
+            float(self.values.size)
+        np.testing.assert_allclose(ranks, q, atol=0.001)
+        self.assertLess(len(d.means), 400)
+
+    def test_summarize(self):
+        """
+        Test tiled summaries with nodata across workers
+        """
+        re = envelope.RasterEnvelope(0.0, 0.0, 100.0, 100.0, 1.0)
+        full = _read_tile(re)
+        values = full[full != -9999.0]
+        for (n_workers, use_processes) in ((1, False), (3, False), (2, True)):
+            summary = stats.summarize(re, _read_tile, tile_size=32,
+                n_workers=n_workers, use_processes=use_processes,
+                nodata=-9999.0, hist_range=(0.0, 100000.0), n_bins=100)
+            self.assertEqual(summary.moments.count, values.size)
+            self.assertAlmostEqual(summary.moments.mean, values.mean(),
+                places=3)
+            self.assertEqual(summary.histogram.count, values.size)
+            self.assertAlmostEqual(float(summary.quantile(0.5)),
+                np.median(values), delta=1000.0)
+
+    def test_summary_merge(self):
+        """
+        Test that summaries with mismatched histograms are not merged
+        """
+        with_hist = stats.RasterSummary(hist_range=(0.0, 10.0), n_bins=10)
+        other_hist = stats.RasterSummary(hist_range=(0.0, 20.0), n_bins=10)
+        without_hist = stats.RasterSummary()
+        for summary in (with_hist, other_hist, without_hist):
+            summary.update(np.arange(10.0))
+
+        self.assertRaises(stats.StatisticsError, with_hist.merge,
+            without_hist)
+        self.assertRaises(stats.StatisticsError, without_hist.merge,
+            with_hist)
+        self.assertRaises(stats.StatisticsError, with_hist.merge,
+            other_hist)
+
+        # Failed merges leave the summary unchanged
+        self.assertEqual(with_hist.moments.count, 10)
+        with_hist.merge(stats.RasterSummary(hist_range=(0.0, 10.0),
+            n_bins=10))
+        self.assertEqual(with_hist.histogram.count, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
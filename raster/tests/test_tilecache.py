@@ -0,0 +1,186 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for TileCache class
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import tilecache
+
+
+def _fill_cache(cache_dir, value):
+    """
+    Write the same keys from another process
+    """
+    cache = tilecache.TileCache(cache_dir)
+    re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+    for tile_re in envelope.get_tiles(re, 5):
+        key = cache.get_key(tile_re, 'fp', 'v1')
+        cache.put(key, np.full((5, 5), value))
+
+
+class TileCacheTest(unittest.TestCase):
+    """
+    TileCache class tests
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.re = envelope.RasterEnvelope(0.0, 0.0, 10.0, 10.0, 1.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_keys(self):
+        """
+        Test that keys depend on envelope, fingerprint and version
+        """
+        get_key = tilecache.TileCache.get_key
+        tile_re = self.re.get_window(0, 0, 5, 5)
+        same_re = envelope.RasterEnvelope(1e-9, 5.0, 5.0, 10.0, 1.0)
+        key = get_key(tile_re, 'fp', 'v1')
+        self.assertEqual(key, get_key(same_re, 'fp', 'v1'))
+        self.assertNotEqual(key, get_key(self.re.get_window(5, 0, 5, 5),
+            'fp', 'v1'))
+        self.assertNotEqual(key, get_key(tile_re, 'fp2', 'v1'))
+        self.assertNotEqual(key, get_key(tile_re, 'fp', 'v2'))
+
+    def test_get_put(self):
+        """
+        Test round trip and metrics
+        """
+        cache = tilecache.TileCache(self.cache_dir)
+        tile_re = self.re.get_window(0, 0, 5, 5)
+        calls = []
+
+        def compute(t):
+            calls.append(t)
+            return np.arange(t.x_size * t.y_size).reshape(t.y_size, t.x_size)
+
+        arr_1 = cache.get_or_compute(tile_re, 'fp', 'v1', compute)
+        arr_2 = cache.get_or_compute(tile_re, 'fp', 'v1', compute)
+        np.testing.assert_array_equal(arr_1, arr_2)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['hit_rate'], 0.5)
+
+        # Persisted across instances
+        cache = tilecache.TileCache(self.cache_dir)
+        key = cache.get_key(tile_re, 'fp', 'v1')
+        np.testing.assert_array_equal(cache.get(key), arr_1)
+        cache.clear()
+        self.assertIsNone(cache.get(key))
+
+    def test_eviction(self):
+        """
+        Test least-recently-used eviction
+        """
+        arr = np.zeros((10, 10), dtype=np.float64)
+        cache = tilecache.TileCache(self.cache_dir, max_bytes=2500)
+        keys = [cache.get_key(self.re, 'fp', str(i)) for i in range(3)]
+        for (i, key) in enumerate(keys[:2]):
+            cache.put(key, arr)
+            os.utime(cache._get_path(key), (i, i))
+
+        # Touch the first entry so the second is evicted
+        self.assertIsNotNone(cache.get(keys[0]))
+        cache.put(keys[2], arr)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_overwrite(self):
+        """
+        Test that overwriting an entry does not grow the accounted size
+        """
+        arr = np.zeros((10, 10), dtype=np.float64)
+        cache = tilecache.TileCache(self.cache_dir, max_bytes=2500)
+        keys = [cache.get_key(self.re, 'fp', str(i)) for i in range(2)]
+        cache.put(keys[0], arr)
+        size = cache._total_bytes
+        for _ in range(3):
+            cache.put(keys[0], arr)
+        self.assertEqual(cache._total_bytes, size)
+        cache.put(keys[1], arr)
+        self.assertEqual(cache.evictions, 0)
+        self.assertIsNotNone(cache.get(keys[0]))
+
+    def test_low_water(self):
+        """
+        Test eviction to the low-water mark and removal of stale
+        temporary files
+        """
+        arr = np.zeros((10, 10), dtype=np.float64)
+        cache = tilecache.TileCache(self.cache_dir, max_bytes=2500,
+            low_water=0.6)
+        keys = [cache.get_key(self.re, 'fp', str(i)) for i in range(4)]
+        for (i, key) in enumerate(keys[:3]):
+            cache.put(key, arr)
+            os.utime(cache._get_path(key), (i, i))
+        self.assertEqual(cache.evictions, 2)
+        self.assertIsNotNone(cache.get(keys[2]))
+
+        # The next put fits below max_bytes without another eviction
+        cache.put(keys[3], arr)
+        self.assertEqual(cache.evictions, 2)
+
+        stale = os.path.join(self.cache_dir, 'stale.tmp')
+        fresh = os.path.join(self.cache_dir, 'fresh.tmp')
+        for path in (stale, fresh):
+            with open(path, 'wb') as fh:
+                fh.write(b'partial')
+        os.utime(stale, (0, 0))
+        cache.evict()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+        self.assertRaises(tilecache.TileCacheError, tilecache.TileCache,
+            self.cache_dir, low_water=0.0)
+
+    def test_fingerprint(self):
+        """
+        Test input fingerprints
+        """
+        path = os.path.join(self.tmp_dir, 'a.txt')
+        with open(path, 'w') as fh:
+            fh.write('abc')
+        fp = tilecache.get_fingerprint([path])
+        content_fp = tilecache.get_fingerprint([path], content=True)
+        os.utime(path, (0, 0))
+        self.assertNotEqual(fp, tilecache.get_fingerprint([path]))
+        self.assertEqual(content_fp,
+            tilecache.get_fingerprint([path], content=True))
+
+    def test_concurrent_writers(self):
+        """
+        Test that concurrent processes writing the same keys leave complete
+        entries
+        """
+        procs = [multiprocessing.Process(target=_fill_cache,
+            args=(self.cache_dir, i)) for i in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        cache = tilecache.TileCache(self.cache_dir)
+        for tile_re in envelope.get_tiles(self.re, 5):
+            arr = cache.get(cache.get_key(tile_re, 'fp', 'v1'))
+            self.assertEqual(arr.shape, (5, 5))
+            self.assertEqual(len(np.unique(arr)), 1)
+        tmp_files = [f for (_, _, files) in os.walk(self.cache_dir)
+            for f in files if f.endswith('.tmp')]
+        self.assertEqual(tmp_files, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
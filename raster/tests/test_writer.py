@@ -0,0 +1,122 @@
+#pylint: disable=invalid-name
+
+"""
+Tests for TiledWriter class
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import warnings
+
+import numpy as np
+from osgeo import gdal, gdalconst
+
+from spatial_tools.raster import envelope
+from spatial_tools.raster import writer
+
+
+class TiledWriterTest(unittest.TestCase):
+    """
+    TiledWriter class tests
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'out.tif')
+        self.re = envelope.RasterEnvelope(0.0, 0.0, 100.0, 80.0, 1.0)
+        self.arr = np.arange(8000, dtype=np.int32).reshape(80, 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_concurrent_writes(self):
+        """
+        Test tiles written in random order from several threads
+        """
+        tiles = envelope.get_tiles(self.re, 32)
+        random.shuffle(tiles)
+
+        def produce(w, tile_list):
+            for tile_re in tile_list:
+                (x_off, y_off) = envelope.get_grid_offset(self.re, tile_re)
+                w.write(tile_re, self.arr[y_off:y_off + tile_re.y_size,
+                    x_off:x_off + tile_re.x_size])
+
+        with writer.TiledWriter(self.path, self.re, dtype=np.int32,
+                block_size=32, compress='DEFLATE', max_queued=2,
+                overviews=(2,)) as w:
+            threads = [threading.Thread(target=produce,
+                args=(w, tiles[i::3])) for i in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(w.n_written, len(tiles))
+
+        ds = gdal.Open(self.path, gdalconst.GA_ReadOnly)
+        self.assert_(envelope.RasterEnvelope.from_gdal_dataset(ds) == self.re)
+        band = ds.GetRasterBand(1)
+        np.testing.assert_array_equal(band.ReadAsArray(), self.arr)
+        self.assertEqual(band.GetOverviewCount(), 1)
+        self.assertEqual(band.GetBlockSize(), [32, 32])
+
+    def test_buffer_reuse(self):
+        """
+        Test that a producer may reuse its buffer after write returns
+        """
+        buf = np.empty((16, 16), dtype=np.int32)
+        with writer.TiledWriter(self.path, self.re, dtype=np.int32,
+                block_size=16, max_queued=100, overviews=()) as w:
+            for tile_re in envelope.get_tiles(self.re, 16):
+                (x_off, y_off) = envelope.get_grid_offset(self.re, tile_re)
+                tile = buf[:tile_re.y_size, :tile_re.x_size]
+                tile[:] = self.arr[y_off:y_off + tile_re.y_size,
+                    x_off:x_off + tile_re.x_size]
+                w.write(tile_re, tile)
+        ds = gdal.Open(self.path, gdalconst.GA_ReadOnly)
+        np.testing.assert_array_equal(ds.GetRasterBand(1).ReadAsArray(),
+            self.arr)
+
+    def test_block_alignment(self):
+        """
+        Test that tiles off block boundaries issue a warning
+        """
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with writer.TiledWriter(self.path, self.re, block_size=32,
+                    overviews=()) as w:
+                # Edge tiles may end at the raster edge
+                w.write(self.re.get_window(96, 64, 4, 16),
+                    np.zeros((16, 4)))
+                self.assertEqual(len(caught), 0)
+                w.write(self.re.get_window(16, 0, 16, 16),
+                    np.zeros((16, 16)))
+                w.write(self.re.get_window(48, 0, 16, 16),
+                    np.zeros((16, 16)))
+        self.assertEqual(len(caught), 1)
+        self.assert_(issubclass(caught[0].category, RuntimeWarning))
+
+    def test_invalid_tiles(self):
+        """
+        Test tiles that do not fit the output raster
+        """
+        w = writer.TiledWriter(self.path, self.re, n_bands=2, overviews=())
+        tile_re = self.re.get_window(0, 0, 10, 10)
+        self.assertRaises(writer.RasterWriterError, w.write, tile_re,
+            np.zeros((10, 10)))
+        tile_re = self.re.get_window(95, 0, 10, 10)
+        self.assertRaises(writer.RasterWriterError, w.write, tile_re,
+            np.zeros((2, 10, 10)))
+        tile_re = envelope.RasterEnvelope(0.5, 0.0, 10.5, 10.0, 1.0)
+        self.assertRaises(envelope.EnvelopeError, w.write, tile_re,
+            np.zeros((2, 10, 10)))
+        w.close()
+        self.assertRaises(writer.RasterWriterError, w.write,
+            self.re.get_window(0, 0, 10, 10), np.zeros((2, 10, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
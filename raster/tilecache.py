@@ -0,0 +1,342 @@
+"""
+Persistent on-disk cache of per-tile computation results.  Entries are
+content-addressed by the tile's RasterEnvelope, a fingerprint of the input
+datasets and the version of the function that produced them.  The cache is
+safe to share between concurrent worker processes.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+class TileCacheError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+def get_fingerprint(paths, content=False):
+    """
+    Return a fingerprint of a set of input files.  By default, this is based
+    on each file's absolute path, size and modification time.  If content
+    is True, file contents are hashed instead, which is slower but stable
+    across copies and touches.
+
+    Parameters
+    ----------
+    paths : sequence
+        List or tuple of file names
+
+    content : bool
+        Whether to hash file contents
+
+    Returns
+    -------
+    fingerprint : str
+        Hex digest identifying the inputs
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        if content:
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    sha.update(chunk)
+        else:
+            stat = os.stat(path)
+            sha.update(('%s|%d|%d' % (os.path.abspath(path), stat.st_size,
+                stat.st_mtime_ns)).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class TileCache(object):
+    """
+    A TileCache stores numpy arrays in a directory, one file per entry.
+    Writes go to a temporary file that is atomically renamed into place, so
+    readers in other processes never see partial entries.  Total size is
+    bounded by max_bytes using least-recently-used eviction, where recency
+    is tracked by file modification time so it is shared across processes.
+    Eviction shrinks the cache to a low-water mark below max_bytes so that
+    the directory is not rescanned on every subsequent put.  Hit, miss and
+    eviction counts are kept per instance.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30, low_water=0.9,
+            tmp_max_age=3600.0):
+        """
+        Initialize a TileCache, creating cache_dir if needed
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory in which to store entries
+
+        max_bytes : int
+            Maximum total size of cached entries
+
+        low_water : float
+            Fraction of max_bytes to which eviction shrinks the cache
+
+        tmp_max_age : float
+            Age in seconds after which temporary files left by crashed
+            writers are removed during eviction
+        """
+        if max_bytes <= 0:
+            err_str = 'max_bytes must be positive'
+            raise TileCacheError(err_str)
+        if not 0.0 < low_water <= 1.0:
+            err_str = 'low_water must be in (0, 1]'
+            raise TileCacheError(err_str)
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._low_water = low_water
+        self._tmp_max_age = tmp_max_age
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._total_bytes = sum(size for (_, _, size) in self._scan()[0])
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    @property
+    def stats(self):
+        total = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'hit_rate': float(self._hits) / total if total else 0.0,
+        }
+    # pylint: enable=missing-docstring
+
+    @staticmethod
+    def get_key(tile_re, fingerprint, version):
+        """
+        Return the cache key for a tile
+
+        Parameters
+        ----------
+        tile_re : RasterEnvelope
+            Envelope of the tile
+
+        fingerprint : str
+            Fingerprint of the input datasets (see get_fingerprint)
+
+        version : str
+            Identifier of the function (and parameters) producing the tile
+
+        Returns
+        -------
+        key : str
+            Hex digest of the combined inputs
+        """
+        key_str = '%r|%s|%s' % (tile_re.get_key(), fingerprint, version)
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+    def _get_path(self, key):
+        """
+        Return the file name for a key.  Entries are fanned out over
+        subdirectories to keep directory sizes manageable.
+        """
+        return os.path.join(self._cache_dir, key[:2], key + '.npy')
+
+    def _scan(self):
+        """
+        Return lists of (mtime, path, size) for every entry and for every
+        temporary file in the cache
+        """
+        entries = []
+        tmp_files = []
+        for (dir_path, _, file_names) in os.walk(self._cache_dir):
+            for file_name in file_names:
+                if file_name.endswith('.npy'):
+                    files = entries
+                elif file_name.endswith('.tmp'):
+                    files = tmp_files
+                else:
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return (entries, tmp_files)
+
+    def get(self, key):
+        """
+        Return the cached array for key, or None if not present
+
+        Parameters
+        ----------
+        key : str
+            Cache key (see get_key)
+
+        Returns
+        -------
+        arr : numpy.ndarray or None
+            The cached array
+        """
+        path = self._get_path(key)
+        try:
+            arr = np.load(path, allow_pickle=False)
+        except (IOError, OSError):
+            # Missing, or evicted by another process while being read
+            self._misses += 1
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self._hits += 1
+        return arr
+
+    def put(self, key, arr):
+        """
+        Store an array under key, evicting old entries if the cache grows
+        beyond max_bytes
+
+        Parameters
+        ----------
+        key : str
+            Cache key (see get_key)
+
+        arr : numpy.ndarray
+            The array to store
+        """
+        path = self._get_path(key)
+        dir_name = os.path.dirname(path)
+        if not os.path.isdir(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError:
+                if not os.path.isdir(dir_name):
+                    raise
+
+        (fd, tmp_path) = tempfile.mkstemp(suffix='.tmp', dir=dir_name)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.save(fh, np.asarray(arr), allow_pickle=False)
+            size = os.path.getsize(tmp_path)
+
+            # Overwriting an entry replaces its size rather than adding to it
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._total_bytes += size
+        if self._total_bytes > self._max_bytes:
+            self.evict()
+
+    def get_or_compute(self, tile_re, fingerprint, version, func):
+        """
+        Return the cached result for a tile, computing and storing it with
+        func(tile_re) on a miss
+
+        Parameters
+        ----------
+        tile_re : RasterEnvelope
+            Envelope of the tile
+
+        fingerprint : str
+            Fingerprint of the input datasets
+
+        version : str
+            Identifier of func and its parameters
+
+        func : callable
+            Function returning a numpy array for tile_re
+
+        Returns
+        -------
+        arr : numpy.ndarray
+            The tile result
+        """
+        key = self.get_key(tile_re, fingerprint, version)
+        arr = self.get(key)
+        if arr is None:
+            arr = func(tile_re)
+            self.put(key, arr)
+        return arr
+
+    def evict(self):
+        """
+        Remove least-recently-used entries until the cache is within the
+        low-water mark, along with stale temporary files.  The total size
+        is recomputed from disk so that entries written by other processes
+        are accounted for.
+        """
+        (entries, tmp_files) = self._scan()
+        min_mtime = time.time() - self._tmp_max_age
+        for (mtime, path, _) in tmp_files:
+            if mtime < min_mtime:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        entries.sort()
+        total = sum(size for (_, _, size) in entries)
+        target = self._max_bytes * self._low_water
+        for (_, path, size) in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self._evictions += 1
+            except OSError:
+                # Already removed by another process
+                pass
+            total -= size
+        self._total_bytes = total
+
+    def clear(self):
+        """
+        Remove all entries from the cache
+        """
+        for (_, path, _) in self._scan()[0]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._total_bytes = 0
@@ -0,0 +1,256 @@
+"""
+Tiled GeoTIFF writer that accepts tiles from concurrent producers.  Tiles may
+arrive in any order from any number of threads; a single writer thread owns
+the output dataset and performs all I/O.
+"""
+
+import queue
+import threading
+import warnings
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from spatial_tools.raster import envelope
+
+# Sentinel placed on the queue to stop the writer thread
+_STOP = object()
+
+
+class RasterWriterError(Exception):
+    """
+    Specialized exception to throw
+    """
+    pass
+
+
+class TiledWriter(object):
+    """
+    A TiledWriter creates a tiled (and optionally compressed) GeoTIFF
+    covering a RasterEnvelope and writes tile arrays into it through a
+    single background thread.  Producers call write() with a tile envelope
+    and array; the call only blocks when the bounded buffer is full.
+
+    Block compression is performed by GDAL's own worker pool (the GTiff
+    NUM_THREADS creation option) so that the writer thread only does I/O.
+    This only holds when tile boundaries fall on block boundaries (or the
+    raster edge); otherwise GDAL must re-read, recompress and rewrite
+    partially written blocks, and a warning is issued.  Overviews are built
+    once all tiles have been written.
+    """
+
+    def __init__(self, path, raster_env, n_bands=1, dtype=np.float32,
+            nodata=None, projection=None, block_size=256, compress=None,
+            num_threads='ALL_CPUS', max_queued=16, overviews=(2, 4, 8, 16),
+            resampling='NEAREST'):
+        """
+        Create the output GeoTIFF and start the writer thread
+
+        Parameters
+        ----------
+        path : str
+            Output file name
+
+        raster_env : RasterEnvelope
+            Envelope of the output raster
+
+        n_bands : int
+            Number of output bands
+
+        dtype : numpy.dtype
+            Data type of the output raster
+
+        nodata : number
+            Optional nodata value assigned to all bands
+
+        projection : str
+            Optional WKT projection of the output raster
+
+        block_size : int
+            Width and height of the GeoTIFF tiles.  Must be a multiple of 16
+
+        compress : str
+            GTiff compression (e.g. 'DEFLATE', 'LZW', 'ZSTD') or None
+
+        num_threads : int or str
+            Number of GDAL worker threads used for compression
+
+        max_queued : int
+            Maximum number of tiles buffered before write() blocks
+
+        overviews : sequence
+            Overview decimation levels to build on close.  Empty for none
+
+        resampling : str
+            Resampling method used to build overviews
+        """
+        if block_size % 16:
+            err_str = 'Block size must be a multiple of 16'
+            raise RasterWriterError(err_str)
+
+        self._raster_env = raster_env
+        self._block_size = block_size
+        self._n_bands = n_bands
+        self._dtype = np.dtype(dtype)
+        self._overviews = list(overviews)
+        self._resampling = resampling
+
+        options = [
+            'TILED=YES',
+            'BLOCKXSIZE=%d' % block_size,
+            'BLOCKYSIZE=%d' % block_size,
+            'BIGTIFF=IF_SAFER',
+        ]
+        if compress is not None:
+            options.append('COMPRESS=%s' % compress)
+            options.append('NUM_THREADS=%s' % num_threads)
+
+        gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(self._dtype)
+        driver = gdal.GetDriverByName('GTiff')
+        self._ds = driver.Create(path, raster_env.x_size, raster_env.y_size,
+            n_bands, gdal_type, options=options)
+        if self._ds is None:
+            err_str = 'Unable to create %s' % path
+            raise RasterWriterError(err_str)
+        self._ds.SetGeoTransform(raster_env.get_geotransform())
+        if projection is not None:
+            self._ds.SetProjection(projection)
+        if nodata is not None:
+            for band_num in range(1, n_bands + 1):
+                self._ds.GetRasterBand(band_num).SetNoDataValue(nodata)
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._warned = False
+        self._n_written = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Simple properties to return class attributes
+    # pylint: disable=missing-docstring
+    @property
+    def raster_env(self):
+        return self._raster_env
+
+    @property
+    def n_written(self):
+        return self._n_written
+    # pylint: enable=missing-docstring
+
+    def _run(self):
+        """
+        Writer thread loop.  Pulls tiles off the queue and writes them to
+        the output dataset until the stop sentinel is received.  After an
+        error, remaining tiles are drained so producers do not block.
+        """
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            if self._error is not None:
+                continue
+            (x_off, y_off, arr) = item
+            try:
+                for i in range(self._n_bands):
+                    band = self._ds.GetRasterBand(i + 1)
+                    band.WriteArray(arr[i], x_off, y_off)
+                self._n_written += 1
+            except Exception as e:  # pylint: disable=broad-except
+                self._error = e
+
+    def _check_error(self):
+        """
+        Re-raise any error from the writer thread in the calling thread
+        """
+        if self._error is not None:
+            err_str = 'Writer thread failed: %s' % self._error
+            raise RasterWriterError(err_str)
+
+    def _is_block_aligned(self, x_off, y_off, x_size, y_size):
+        """
+        Tests whether a tile window starts and ends on block boundaries or
+        the raster edge
+        """
+        block_size = self._block_size
+        x_end = x_off + x_size
+        y_end = y_off + y_size
+        return (x_off % block_size == 0 and y_off % block_size == 0 and
+            (x_end % block_size == 0 or x_end == self._raster_env.x_size) and
+            (y_end % block_size == 0 or y_end == self._raster_env.y_size))
+
+    def write(self, tile_env, arr):
+        """
+        Queue a copy of a tile for writing.  Blocks if the buffer is full.
+        This method may be called from any number of threads, and the
+        caller may reuse arr as soon as it returns.
+
+        Parameters
+        ----------
+        tile_env : RasterEnvelope
+            Envelope of the tile.  Must be aligned to, and fall within, the
+            output envelope
+
+        arr : numpy.ndarray
+            Tile data of shape (y_size, x_size) for single band output or
+            (n_bands, y_size, x_size)
+        """
+        self._check_error()
+        arr = np.asarray(arr)
+        if arr.ndim == 2:
+            arr = arr[np.newaxis]
+        shape = (self._n_bands, tile_env.y_size, tile_env.x_size)
+        if arr.shape != shape:
+            err_str = 'Tile array shape %s does not match %s' % (
+                arr.shape, shape)
+            raise RasterWriterError(err_str)
+
+        (x_off, y_off) = envelope.get_grid_offset(self._raster_env, tile_env)
+        if x_off < 0 or y_off < 0 or \
+                x_off + tile_env.x_size > self._raster_env.x_size or \
+                y_off + tile_env.y_size > self._raster_env.y_size:
+            err_str = 'Tile falls outside of the output envelope'
+            raise RasterWriterError(err_str)
+        if not self._warned and not self._is_block_aligned(x_off, y_off,
+                tile_env.x_size, tile_env.y_size):
+            self._warned = True
+            warnings.warn('Tiles are not aligned to %d-cell blocks; blocks '
+                'will be rewritten' % self._block_size, RuntimeWarning)
+
+        # Copy so that producers can reuse their buffers while the tile is
+        # queued
+        arr = np.array(arr, dtype=self._dtype, copy=True)
+
+        # Hold the lock so close() cannot enqueue the stop sentinel between
+        # the closed check and the put
+        with self._lock:
+            if self._closed:
+                err_str = 'Writer is closed'
+                raise RasterWriterError(err_str)
+            self._queue.put((x_off, y_off, arr))
+
+    def close(self):
+        """
+        Flush all queued tiles, build overviews and close the output
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+        try:
+            self._check_error()
+            self._ds.FlushCache()
+            if self._overviews:
+                self._ds.BuildOverviews(self._resampling, self._overviews)
+        finally:
+            self._ds = None